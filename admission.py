@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import asyncio
+from collections import deque
+from typing import Iterable
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class AdmissionController:
+    """Caps concurrent work and keeps a short, bounded queue of waiters."""
+
+    def __init__(
+        self,
+        limit: int,
+        queue_size: int = 0,
+        queue_timeout: float = 1.0,
+    ):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        if queue_size < 0:
+            raise ValueError("queue_size must not be negative")
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.shed = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """Returns True once admitted, or False if the request should be shed."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # release() hands its slot straight to us, so active is already counted
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            return True
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        except TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived just as we timed out; take it rather than leak it
+                return True
+            waiter.cancel()
+            self.shed += 1
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Frees a slot, passing it to the oldest waiter if there is one."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "shed": self.shed,
+        }
+
+
+class AdmissionControlMiddleware:
+    """Applies an AdmissionController to a fixed set of (method, path) routes."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController,
+        routes: Iterable[tuple[str, str]],
+        retry_after: int = 1,
+    ):
+        self.app = app
+        self.controller = controller
+        self.routes = {(method.upper(), path) for method, path in routes}
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or (scope["method"], scope["path"]) not in self.routes
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire():
+            response = JSONResponse(
+                {"detail": "The service is busy. Please try again shortly."},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
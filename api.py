@@ -1,15 +1,39 @@
 #!/usr/bin/env python3
-from requests import get
+import asyncio
+import logging
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from itertools import islice
+from typing import Optional
 
+import httpx
 
-def nbnQueryAddress(address: str) -> dict:
+import servingarea
+import upstream
+from cache import TTLS, cache_key, get_cache
+from upstream import get_sync as get
+
+# Kept free of web framework imports so this module stays usable as a library;
+# this is the logger logconfig.get_logger("api") would return
+logger = logging.getLogger("nbnchecker.api")
+
+# Upstream endpoints and the header the NBN API expects on every call
+autocompleteEndpoint = "https://places.nbnco.net.au/places/v1/autocomplete"
+autocompleteUrl = autocompleteEndpoint + "?query={}"
+detailsUrl = "https://places.nbnco.net.au/places/v2/details/{}"
+nbnHeaders = upstream.NBN_HEADERS
+
+# Default number of calls a batch keeps in flight
+defaultConcurrency = 10
+
+# Batches look up at least this many items in the shared cache per round trip
+prefetchSize = 100
+
+
+def _parseQueryAddress(apiResponse: dict) -> dict:
     # Empty dict to store results
     results = {}
 
-    # Poke the NBN autocomplete API with the supplied address to check
-    apiUrl = f"https://places.nbnco.net.au/places/v1/autocomplete?query={address}"
-    apiResponse = get(apiUrl, headers={"Referer": "https://www.nbnco.com.au"}).json()
-
     # Check if 'suggestions' key exists and is not empty
     if "suggestions" in apiResponse and len(apiResponse["suggestions"]) > 0:
         # Always take the first suggestion for simplicity in the web UI
@@ -34,14 +58,10 @@ def nbnQueryAddress(address: str) -> dict:
     return results
 
 
-def nbnLocDetails(locID: str) -> dict:
+def _parseLocDetails(apiResponse: dict) -> dict:
     # Empty dict to store results
     results = {}
 
-    # Poke the NBN details API with the retrieved location ID
-    apiUrl = f"https://places.nbnco.net.au/places/v2/details/{locID}"
-    apiResponse = get(apiUrl, headers={"Referer": "https://www.nbnco.com.au"}).json()
-
     # Check for an NBN LOC ID in the response
     if "id" in apiResponse["addressDetail"]:
         # An NBN LOC ID is present, return the address details
@@ -65,3 +85,233 @@ def nbnLocDetails(locID: str) -> dict:
         results["csaID"] = apiResponse["servingArea"]["csaId"]
         results["techType"] = apiResponse["servingArea"]["techType"]
     return results
+
+
+def nbnQueryAddress(address: str) -> dict:
+    # Poke the NBN autocomplete API with the supplied address to check
+    apiUrl = autocompleteUrl.format(address)
+    apiResponse = get(apiUrl, headers=nbnHeaders).json()
+    return _parseQueryAddress(apiResponse)
+
+
+def nbnLocDetails(locID: str) -> dict:
+    # Poke the NBN details API with the retrieved location ID
+    apiUrl = detailsUrl.format(locID)
+    apiResponse = get(apiUrl, headers=nbnHeaders).json()
+    return _parseLocDetails(apiResponse)
+
+
+def getAsyncClient() -> httpx.AsyncClient:
+    """Returns the shared async client used by every upstream call."""
+    return upstream.async_client()
+
+
+async def closeAsyncClient() -> None:
+    """Closes the shared clients and their connection pools."""
+    await upstream.close()
+
+
+def _logCache(cache: str, key: str, hit: bool) -> None:
+    logger.info(
+        "%s cache %s",
+        cache,
+        "hit" if hit else "miss",
+        extra={
+            "event": "cache",
+            "cache": cache,
+            "hit": hit,
+            "key": key,
+            "sampled": True,
+        },
+    )
+
+
+async def cachedFetch(
+    kind: str, key: str, fetch: Callable[[], Awaitable[dict]]
+) -> tuple[dict, bool]:
+    """Returns a raw NBN API response and whether `fetch` was called for it.
+
+    Every lookup path goes through here. Details of premises known to
+    resolve only to a serving area come from the CSA cache. Otherwise the
+    response cache (if configured) is tried. Only when both miss is the API
+    called, and its response is fed back to both caches. A response that
+    wasn't fetched is not a new observation of the premises.
+    """
+    if kind == "details":
+        cached = servingarea.serving_areas.lookup(key)
+        _logCache("serving_area", key, cached is not None)
+        if cached is not None:
+            return cached, False
+    cache = get_cache()
+    if cache is not None:
+        cached = await cache.get(cache_key(kind, key))
+        _logCache(kind, key, cached is not None)
+        if cached is not None:
+            return cached, False
+    data = await fetch()
+    if kind == "details":
+        servingarea.serving_areas.observe(key, data)
+    if cache is not None:
+        await cache.set(cache_key(kind, key), data, TTLS[kind])
+    return data, True
+
+
+async def _fetchJson(
+    kind: str,
+    key: str,
+    url: str,
+    client: httpx.AsyncClient,
+    params: Optional[dict] = None,
+) -> tuple[dict, bool]:
+    async def fetch() -> dict:
+        apiResponse = await client.get(url, params=params)
+        apiResponse.raise_for_status()
+        return apiResponse.json()
+
+    return await cachedFetch(kind, key, fetch)
+
+
+async def nbnQueryAddressAsync(
+    address: str, client: Optional[httpx.AsyncClient] = None
+) -> dict:
+    """Async counterpart of nbnQueryAddress using a pooled connection."""
+    client = client or getAsyncClient()
+    # Passed as a parameter so "#", "&" and "+" in addresses are encoded
+    apiResponse, _ = await _fetchJson(
+        "autocomplete", address, autocompleteEndpoint, client, params={"query": address}
+    )
+    return _parseQueryAddress(apiResponse)
+
+
+async def nbnAutocompleteAsync(
+    query: str, client: Optional[httpx.AsyncClient] = None
+) -> list[dict]:
+    """Returns every raw suggestion the autocomplete API gives for a query."""
+    client = client or getAsyncClient()
+    # Passed as a parameter so "#", "&" and "+" in addresses are encoded
+    apiResponse, _ = await _fetchJson(
+        "autocomplete", query, autocompleteEndpoint, client, params={"query": query}
+    )
+    return apiResponse.get("suggestions", [])
+
+
+async def nbnLocDetailsAsync(
+    locID: str, client: Optional[httpx.AsyncClient] = None
+) -> dict:
+    """Async counterpart of nbnLocDetails using a pooled connection."""
+    details, _ = await nbnLocDetailsFetchAsync(locID, client)
+    return details
+
+
+async def nbnLocDetailsFetchAsync(
+    locID: str, client: Optional[httpx.AsyncClient] = None
+) -> tuple[dict, bool]:
+    """Like nbnLocDetailsAsync, plus whether the NBN API was called for it.
+
+    The flag is False when the details were answered from a cache, so they
+    aren't new observations of the premises.
+    """
+    client = client or getAsyncClient()
+    apiResponse, fetched = await _fetchJson(
+        "details", locID, detailsUrl.format(locID), client
+    )
+    return _parseLocDetails(apiResponse), fetched
+
+
+async def _runBatch(
+    func,
+    items: Iterable[str],
+    concurrency: int,
+    returnExceptions: bool,
+    client: Optional[httpx.AsyncClient],
+    kind: str,
+) -> AsyncIterator[tuple[str, dict | BaseException]]:
+    # Only keep `concurrency` calls in flight so huge inputs are never fully
+    # materialised as tasks, and hand results back as soon as each one lands
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    ownedClient = None
+    if client is None:
+        if concurrency > upstream.MAX_CONNECTIONS:
+            # On the shared pool the extra calls would queue for a connection
+            # and could fail with a PoolTimeout instead of an upstream error
+            client = ownedClient = upstream.create_async_client(concurrency)
+        else:
+            client = getAsyncClient()
+    iterator = iter(items)
+    lookahead: deque[str] = deque()
+    pending: dict[asyncio.Task, str] = {}
+    cache = get_cache()
+
+    async def fill():
+        while len(pending) < concurrency:
+            if not lookahead:
+                chunk = list(islice(iterator, max(concurrency, prefetchSize)))
+                if not chunk:
+                    return
+                if cache is not None:
+                    # One pipelined round trip to the shared cache for the
+                    # whole chunk instead of one per item
+                    await cache.prefetch([cache_key(kind, item) for item in chunk])
+                lookahead.extend(chunk)
+            item = lookahead.popleft()
+            pending[asyncio.ensure_future(func(item, client))] = item
+
+    try:
+        await fill()
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                item = pending.pop(task)
+                if task.exception() is not None:
+                    if not returnExceptions:
+                        raise task.exception()
+                    yield item, task.exception()
+                else:
+                    yield item, task.result()
+            await fill()
+    finally:
+        # Don't leave orphaned upstream calls behind if the consumer stops early
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if ownedClient is not None:
+            await ownedClient.aclose()
+
+
+def nbnQueryAddressBatch(
+    addresses: Iterable[str],
+    concurrency: int = defaultConcurrency,
+    returnExceptions: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[tuple[str, dict | BaseException]]:
+    """Yields (address, result) pairs in completion order.
+
+    A client passed in should allow at least `concurrency` connections.
+    """
+    return _runBatch(
+        nbnQueryAddressAsync,
+        addresses,
+        concurrency,
+        returnExceptions,
+        client,
+        "autocomplete",
+    )
+
+
+def nbnLocDetailsBatch(
+    locIDs: Iterable[str],
+    concurrency: int = defaultConcurrency,
+    returnExceptions: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+) -> AsyncIterator[tuple[str, dict | BaseException]]:
+    """Yields (locID, result) pairs in completion order.
+
+    A client passed in should allow at least `concurrency` connections.
+    """
+    return _runBatch(
+        nbnLocDetailsAsync, locIDs, concurrency, returnExceptions, client, "details"
+    )
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Any, Optional
+from urllib.parse import unquote, urlsplit
+
+# Kept free of web framework imports as api.py uses it
+logger = logging.getLogger("nbnchecker.cache")
+
+# How long upstream responses are reused, by kind
+TTLS = {
+    "autocomplete": float(os.environ.get("NBNCHECKER_CACHE_AUTOCOMPLETE_TTL", "86400")),
+    "details": float(os.environ.get("NBNCHECKER_CACHE_DETAILS_TTL", "3600")),
+}
+
+
+def cache_key(kind: str, key: str) -> str:
+    """Builds the shared key for an upstream response of a given kind."""
+    if kind == "autocomplete":
+        key = " ".join(key.lower().split())
+    return f"{kind}:{key}"
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _decode(value: Optional[bytes]) -> Any:
+    return None if value is None else json.loads(value)
+
+
+class CacheError(Exception):
+    """An error reply from, or failure talking to, a cache server."""
+
+
+class CacheBackend(ABC):
+    """Interface for caches of upstream JSON responses.
+
+    Values are anything json.dumps accepts; callers get back a fresh copy.
+    """
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self.get_many([key]))[0]
+
+    @abstractmethod
+    async def get_many(self, keys: list[str]) -> list[Optional[Any]]:
+        """Returns the value (or None) for each key, in order."""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        """Stores a value for `ttl` seconds."""
+
+    async def prefetch(self, keys: list[str]) -> list[Optional[Any]]:
+        """Hints that these keys are about to be read, one by one.
+
+        Returns the values a cache with a shared tier found for them; other
+        caches have nothing to prefetch and return None for every key.
+        """
+        return [None] * len(keys)
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = 10000, max_ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (expires_at, encoded value), least recently used first
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    async def get_many(self, keys: list[str]) -> list[Optional[Any]]:
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[0] <= now:
+                    if entry is not None:
+                        del self._entries[key]
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    values.append(entry[1])
+        return [_decode(value) for value in values]
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        if self.max_ttl is not None:
+            ttl = min(ttl, self.max_ttl)
+        encoded = _encode(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, encoded)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    # RESP2: errors are returned rather than raised so a pipeline can carry on
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Cache server closed the connection")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return CacheError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        count = int(rest)
+        if count < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(count)]
+    raise CacheError(f"Unexpected reply from cache server: {line!r}")
+
+
+class RedisCache(CacheBackend):
+    """Cache on a Redis-protocol server (Redis, Valkey, KeyDB, ...).
+
+    Speaks just enough RESP over asyncio streams for GET/MGET/SET, pipelining
+    every command of a call into one round trip. Connections are pooled per
+    event loop.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_connections: int = 8,
+        timeout: float = 0.5,
+        prefix: str = "nbnchecker:",
+    ):
+        parsed = urlsplit(url)
+        if parsed.scheme not in ("redis", "rediss"):
+            raise ValueError(f"Not a redis:// URL: {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.tls = parsed.scheme == "rediss"
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.tls or None
+        )
+        setup = []
+        if self.password is not None:
+            auth = [self.username] if self.username else []
+            setup.append(_command(b"AUTH", *auth, self.password))
+        if self.db:
+            setup.append(_command(b"SELECT", self.db))
+        if setup:
+            writer.write(b"".join(setup))
+            await writer.drain()
+            for _ in setup:
+                reply = await _read_reply(reader)
+                if isinstance(reply, CacheError):
+                    writer.close()
+                    raise reply
+        return reader, writer
+
+    @staticmethod
+    def _discard(writer: asyncio.StreamWriter) -> None:
+        try:
+            writer.close()
+        except RuntimeError:
+            # Its event loop has already been closed
+            pass
+
+    async def _pipeline(self, commands: list[bytes]) -> list:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Streams belong to the loop that opened them
+            for _, writer in self._idle:
+                self._discard(writer)
+            self._idle = []
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_connections)
+        async with self._slots:
+            reader, writer = self._idle.pop() if self._idle else await self._connect()
+            try:
+                writer.write(b"".join(commands))
+                await writer.drain()
+                replies = [await _read_reply(reader) for _ in commands]
+            except BaseException:
+                # Replies may be left unread; never reuse the connection
+                self._discard(writer)
+                raise
+            self._idle.append((reader, writer))
+        return replies
+
+    async def _call(self, commands: list[bytes]) -> list:
+        try:
+            replies = await asyncio.wait_for(self._pipeline(commands), self.timeout)
+        except (OSError, EOFError, asyncio.IncompleteReadError, TimeoutError) as e:
+            raise CacheError(f"Cache server unavailable: {e!r}") from e
+        for reply in replies:
+            if isinstance(reply, CacheError):
+                raise reply
+        return replies
+
+    async def get_many(self, keys: list[str]) -> list[Optional[Any]]:
+        if not keys:
+            return []
+        [values] = await self._call(
+            [_command(b"MGET", *(self.prefix + key for key in keys))]
+        )
+        found = sum(1 for value in values if value is not None)
+        self.hits += found
+        self.misses += len(values) - found
+        return [_decode(value) for value in values]
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.set_many([(key, value)], ttl)
+
+    async def set_many(self, items: Iterable[tuple[str, Any]], ttl: float) -> None:
+        """Stores several values in one pipelined round trip."""
+        seconds = max(int(ttl), 1)
+        commands = [
+            _command(b"SET", self.prefix + key, _encode(value), b"EX", seconds)
+            for key, value in items
+        ]
+        if commands:
+            await self._call(commands)
+
+    async def close(self) -> None:
+        for _, writer in self._idle:
+            self._discard(writer)
+            try:
+                await writer.wait_closed()
+            except (OSError, RuntimeError):
+                pass
+        self._idle = []
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class TieredCache(CacheBackend):
+    """A small local cache (L1) in front of a shared one (L2).
+
+    The shared cache is best-effort: if it fails, lookups carry on as misses
+    and it is skipped for `retry_after` seconds rather than slowing every
+    request down with timeouts.
+    """
+
+    def __init__(self, local: MemoryCache, shared: CacheBackend, retry_after: float = 5):
+        self.local = local
+        self.shared = shared
+        self.retry_after = retry_after
+        self.shared_errors = 0
+        self._skip_until = 0.0
+        # Keys a prefetch found in neither cache, so the reads that follow
+        # don't ask the shared cache again; key -> expires_at
+        self._absent: OrderedDict[str, float] = OrderedDict()
+
+    def _shared_available(self) -> bool:
+        return time.monotonic() >= self._skip_until
+
+    def _shared_failed(self, error: Exception) -> None:
+        self.shared_errors += 1
+        self._skip_until = time.monotonic() + self.retry_after
+        logger.warning(
+            "Shared cache unavailable; using the local cache only",
+            extra={"event": "cache_error", "error": str(error)},
+        )
+
+    async def get_many(self, keys: list[str]) -> list[Optional[Any]]:
+        values = await self.local.get_many(keys)
+        now = time.monotonic()
+        missing = [
+            i
+            for i, value in enumerate(values)
+            if value is None and self._absent.pop(keys[i], 0) <= now
+        ]
+        if not missing or not self._shared_available():
+            return values
+        try:
+            shared = await self.shared.get_many([keys[i] for i in missing])
+        except CacheError as e:
+            self._shared_failed(e)
+            return values
+        for i, value in zip(missing, shared):
+            if value is not None:
+                values[i] = value
+                await self.local.set(keys[i], value, self.local.max_ttl or 60)
+        return values
+
+    async def prefetch(self, keys: list[str]) -> list[Optional[Any]]:
+        # Pulls shared hits into the local cache with a single MGET
+        values = await self.get_many(keys)
+        expires_at = time.monotonic() + (self.local.max_ttl or 30)
+        for key, value in zip(keys, values):
+            if value is None:
+                self._absent[key] = expires_at
+        while len(self._absent) > self.local.max_entries:
+            self._absent.popitem(last=False)
+        return values
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self.local.set(key, value, ttl)
+        if not self._shared_available():
+            return
+        try:
+            await self.shared.set(key, value, ttl)
+        except CacheError as e:
+            self._shared_failed(e)
+
+    async def close(self) -> None:
+        await self.shared.close()
+
+    def stats(self) -> dict:
+        return {
+            "local": self.local.stats(),
+            "shared": {**self.shared.stats(), "errors": self.shared_errors},
+        }
+
+
+_cache: Optional[CacheBackend] = None
+_cache_url: Optional[str] = None
+
+
+def create_cache(url: str) -> CacheBackend:
+    """Builds a cache from a URL: "memory", or redis://[user:password@]host[:port][/db]."""
+    local_size = int(os.environ.get("NBNCHECKER_CACHE_LOCAL_SIZE", "10000"))
+    if url == "memory":
+        return MemoryCache(local_size)
+    if url.startswith(("redis://", "rediss://")):
+        local_ttl = float(os.environ.get("NBNCHECKER_CACHE_LOCAL_TTL", "30"))
+        return TieredCache(MemoryCache(local_size, max_ttl=local_ttl), RedisCache(url))
+    raise ValueError(f"Unsupported NBNCHECKER_CACHE_URL: {url}")
+
+
+def get_cache() -> Optional[CacheBackend]:
+    """Returns the configured cache, or None when NBNCHECKER_CACHE_URL is unset."""
+    global _cache, _cache_url
+    url = os.environ.get("NBNCHECKER_CACHE_URL")
+    if not url:
+        return None
+    if _cache is None or _cache_url != url:
+        _cache, _cache_url = create_cache(url), url
+    return _cache
+
+
+async def close_cache() -> None:
+    global _cache, _cache_url
+    if _cache is not None:
+        await _cache.close()
+        _cache = _cache_url = None
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import re
+import sys
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from api import getAsyncClient, nbnAutocompleteAsync, nbnLocDetailsFetchAsync
+from fairqueue import RateLimiter
+from logconfig import get_logger
+
+logger = get_logger("crawler")
+
+# Matches an optional unit ("3/", "Unit 3 ") followed by a house number and the
+# street, e.g. "3/12A Smith St, SUBURB NSW 2000"
+SEED_PATTERN = re.compile(
+    r"^\s*(?:(?:unit|apt|flat|shop|suite)\s+\w+\s+|\w+\s*/\s*)?"
+    r"(?P<house>\d+[A-Za-z]?)\s+(?P<street>.+?)\s*$",
+    re.IGNORECASE,
+)
+
+
+# Street types are compared by one spelling, whichever the address uses
+STREET_TYPES = {
+    "STREET": "ST",
+    "ROAD": "RD",
+    "AVENUE": "AVE",
+    "AV": "AVE",
+    "DRIVE": "DR",
+    "COURT": "CT",
+    "PLACE": "PL",
+    "LANE": "LN",
+    "CRESCENT": "CRES",
+    "PARADE": "PDE",
+    "HIGHWAY": "HWY",
+    "TERRACE": "TCE",
+    "CLOSE": "CL",
+    "BOULEVARD": "BVD",
+    "BLVD": "BVD",
+    "CIRCUIT": "CCT",
+    "GROVE": "GR",
+}
+
+
+def _words(text: str) -> list[str]:
+    return [
+        STREET_TYPES.get(word, word) for word in re.findall(r"[A-Z0-9]+", text.upper())
+    ]
+
+
+@dataclass(frozen=True)
+class Seed:
+    """A parsed seed address: the street plus an optional house number."""
+
+    street: str
+    house: Optional[str] = None
+
+    @classmethod
+    def parse(cls, address: str) -> "Seed":
+        if not _words(address):
+            raise ValueError("The seed address is empty")
+        match = SEED_PATTERN.match(address)
+        if not match:
+            return cls(street=address.strip())
+        return cls(street=match.group("street"), house=match.group("house"))
+
+    @property
+    def street_words(self) -> list[str]:
+        """The street name, e.g. ["SMITH", "ST"], which must appear whole."""
+        return _words(self.street.split(",", 1)[0])
+
+    @property
+    def locality_words(self) -> list[str]:
+        """Suburb, state and postcode given after a comma, if any."""
+        parts = self.street.split(",", 1)
+        return _words(parts[1]) if len(parts) > 1 else []
+
+    def query(self, prefix: str = "") -> str:
+        """Builds an autocomplete query, expanding the unit or house number prefix."""
+        if self.house:
+            # Building mode: enumerate units within the building
+            if prefix:
+                return f"{prefix}/{self.house} {self.street}"
+            return f"{self.house} {self.street}"
+        # Street mode: enumerate house numbers along the street
+        if prefix:
+            return f"{prefix} {self.street}"
+        return self.street
+
+    def matches(self, formatted_address: str) -> bool:
+        """Checks a suggestion belongs to this building/street (and suburb)."""
+        words = _words(formatted_address)
+        if any(word not in words for word in self.locality_words):
+            return False
+        street = self.street_words
+        for start in range(len(words) - len(street) + 1):
+            if words[start:start + len(street)] != street:
+                continue
+            # In building mode the house number comes right before the street,
+            # e.g. "3/12 SMITH ST" or "UNIT 3 12 SMITH ST"
+            if not self.house or (start and words[start - 1] == self.house.upper()):
+                return True
+        return False
+
+
+class Crawler:
+    """Enumerates the premises in a building or along a street from a seed address."""
+
+    def __init__(
+        self,
+        concurrency: int = 5,
+        rate: float = 5.0,
+        saturation: int = 10,
+        max_prefix_length: int = 3,
+        max_queries: int = 500,
+        client: Optional[httpx.AsyncClient] = None,
+        on_fetched: Optional[Callable[[str, dict], None]] = None,
+    ):
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate, burst=concurrency)
+        # An autocomplete response with this many suggestions is assumed to be
+        # truncated, so the query gets refined with a longer prefix
+        self.saturation = saturation
+        self.max_prefix_length = max_prefix_length
+        self.max_queries = max_queries
+        self.client = client
+        # Called with details fetched from the NBN API (not from a cache)
+        self.on_fetched = on_fetched
+
+    async def crawl(self, address: str, street: bool = False) -> AsyncIterator[dict]:
+        """Yields one record per discovered LOC ID as its details arrive.
+
+        Records carry either a "details" dict or an "error" string. Failed
+        autocomplete queries are reported with a "query" key instead.
+        """
+        seed = Seed.parse(address)
+        if street:
+            seed = Seed(street=seed.street)
+        client = self.client or getAsyncClient()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        output: asyncio.Queue = asyncio.Queue()
+        seen_queries: set[str] = set()
+        seen_locs: set[str] = set()
+        done = object()
+
+        async def fetch_details(loc_id: str, formatted_address: str):
+            async with semaphore:
+                await self.limiter.wait()
+                record = {"locID": loc_id, "address": formatted_address}
+                try:
+                    details, fetched = await nbnLocDetailsFetchAsync(loc_id, client)
+                    record["details"] = details
+                    if fetched and self.on_fetched is not None:
+                        self.on_fetched(loc_id, details)
+                except Exception as e:
+                    logger.warning(
+                        "Crawl details lookup failed",
+                        extra={"event": "crawl_error", "loc_id": loc_id, "error": str(e)},
+                    )
+                    record["error"] = str(e)
+            await output.put(record)
+
+        async def search(tg: asyncio.TaskGroup, prefix: str):
+            query = seed.query(prefix)
+            async with semaphore:
+                await self.limiter.wait()
+                try:
+                    suggestions = await nbnAutocompleteAsync(query, client)
+                except Exception as e:
+                    logger.warning(
+                        "Crawl autocomplete query failed",
+                        extra={"event": "crawl_error", "query": query, "error": str(e)},
+                    )
+                    await output.put({"query": query, "error": str(e)})
+                    return
+
+            for suggestion in suggestions:
+                loc_id = suggestion.get("id", "")
+                formatted_address = suggestion.get("formattedAddress", "")
+                if (
+                    loc_id.startswith("LOC")
+                    and loc_id not in seen_locs
+                    and seed.matches(formatted_address)
+                ):
+                    seen_locs.add(loc_id)
+                    tg.create_task(fetch_details(loc_id, formatted_address))
+
+            if (
+                len(suggestions) >= self.saturation
+                and len(prefix) < self.max_prefix_length
+            ):
+                for digit in "0123456789" if prefix else "123456789":
+                    child = prefix + digit
+                    if child not in seen_queries and len(seen_queries) < self.max_queries:
+                        seen_queries.add(child)
+                        tg.create_task(search(tg, child))
+
+        async def run():
+            try:
+                async with asyncio.TaskGroup() as tg:
+                    seen_queries.add("")
+                    tg.create_task(search(tg, ""))
+            finally:
+                await output.put(done)
+
+        runner = asyncio.create_task(run())
+        try:
+            while (record := await output.get()) is not done:
+                yield record
+            await runner
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    crawler = Crawler(
+        concurrency=args.concurrency,
+        rate=args.rate,
+        max_prefix_length=args.max_prefix_length,
+    )
+    async for record in crawler.crawl(args.address, street=args.street):
+        sys.stdout.write(json.dumps(record) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Enumerate every LOC ID in a building or along a street."
+    )
+    parser.add_argument("address", help="seed address, e.g. '12 Smith St, SUBURB NSW 2000'")
+    parser.add_argument(
+        "--street",
+        action="store_true",
+        help="enumerate house numbers along the street instead of units in a building",
+    )
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=5.0, help="upstream calls per second")
+    parser.add_argument("--max-prefix-length", type=int, default=3)
+    args = parser.parse_args()
+    try:
+        Seed.parse(args.address)
+    except ValueError as e:
+        parser.error(str(e))
+    asyncio.run(_main(args))
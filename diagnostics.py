@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import asyncio
+import io
+import os
+import secrets
+from typing import Iterable, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ADMIN_HEADER = "X-Admin-Token"
+PROFILE_HEADER = "X-Profile"
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    """Checks a supplied token against NBNCHECKER_ADMIN_TOKEN.
+
+    Diagnostics are disabled entirely when no admin token is configured.
+    """
+    expected = os.environ.get("NBNCHECKER_ADMIN_TOKEN")
+    if not expected or not token:
+        return False
+    return secrets.compare_digest(token.encode(), expected.encode())
+
+
+async def require_admin(request: Request) -> None:
+    """Dependency that hides admin routes from anyone without the token."""
+    if not admin_token_valid(request.headers.get(ADMIN_HEADER)):
+        raise HTTPException(status_code=404)
+
+
+class ProfilingMiddleware:
+    """Profiles a single request with cProfile and returns the report instead.
+
+    Triggered by a `profile` query parameter or an X-Profile header on one of
+    the configured routes, and only for callers presenting the admin token.
+    cProfile sees everything running on the event loop thread while the
+    request is in flight, so profiles are serialised and are cleanest on a
+    quiet instance.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Iterable[tuple[str, str]],
+        limit: int = 40,
+    ):
+        self.app = app
+        self.routes = {(method.upper(), path) for method, path in routes}
+        self.limit = limit
+        self._lock = asyncio.Lock()
+
+    def _wants_profile(self, scope: Scope) -> bool:
+        if (
+            scope["type"] != "http"
+            or (scope["method"], scope["path"]) not in self.routes
+        ):
+            return False
+        headers = Headers(scope=scope)
+        query = QueryParams(scope.get("query_string", b""))
+        if "profile" not in query and PROFILE_HEADER not in headers:
+            return False
+        return admin_token_valid(headers.get(ADMIN_HEADER))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if self._lock.locked():
+            response = PlainTextResponse(
+                "Another request is already being profiled.", status_code=409
+            )
+            await response(scope, receive, send)
+            return
+
+        import cProfile
+        import pstats
+        import time
+
+        status = None
+
+        async def capture(message: Message) -> None:
+            # Swallow the real response; the report replaces it
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        async with self._lock:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, capture)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+
+        report = io.StringIO()
+        report.write(
+            f"{scope['method']} {scope['path']} -> {status} "
+            f"in {elapsed * 1000:.1f} ms\n\n"
+        )
+        stats = pstats.Stats(profiler, stream=report)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(self.limit)
+        await PlainTextResponse(report.getvalue())(scope, receive, send)
+
+
+router = APIRouter(
+    prefix="/admin/memory",
+    dependencies=[Depends(require_admin)],
+    include_in_schema=False,
+)
+
+# The snapshot from the previous call, so each call reports growth since then
+_last_snapshot = None
+
+
+def _location(stat) -> str:
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+@router.post("/start")
+async def start_tracing(frames: int = 1):
+    """Starts tracemalloc, which slows allocations while it is running."""
+    import tracemalloc
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return {"tracing": True}
+
+
+@router.post("/stop")
+async def stop_tracing():
+    """Stops tracemalloc and forgets the saved snapshot."""
+    import tracemalloc
+
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+    return {"tracing": False}
+
+
+@router.get("/snapshot")
+async def memory_snapshot(limit: int = 20, key_type: str = "lineno"):
+    """Returns the top allocation sites and their growth since the last snapshot."""
+    import tracemalloc
+
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not running")
+    if key_type not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="Invalid key_type")
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+    current, peak = tracemalloc.get_traced_memory()
+    result = {
+        "traced": {"current": current, "peak": peak},
+        "top": [
+            {"location": _location(stat), "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics(key_type)[:limit]
+        ],
+        "diff": None,
+    }
+    if _last_snapshot is not None:
+        result["diff"] = [
+            {
+                "location": _location(stat),
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+            }
+            for stat in snapshot.compare_to(_last_snapshot, key_type)[:limit]
+        ]
+    _last_snapshot = snapshot
+    return result
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Optional
+
+# Kept free of web framework imports as upstream.py uses it
+if TYPE_CHECKING:
+    from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Scheduling classes, highest priority first
+INTERACTIVE = 0
+BATCH = 1
+
+
+class Client(NamedTuple):
+    """Who upstream calls are being made for, and how to schedule them."""
+
+    name: str
+    priority: int = BATCH
+    # Held to the per-client rate quota
+    metered: bool = True
+
+
+# Set per request by ClientIdentityMiddleware and per chunk by job workers;
+# calls made without one (e.g. api.py used as a library) aren't scheduled
+client_var: ContextVar[Optional[Client]] = ContextVar("client", default=None)
+
+
+class RateLimiter:
+    """Token bucket limiting how often upstream calls may start."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ClientUsage:
+    """Upstream usage counters for one client."""
+
+    def __init__(self):
+        self.requests = 0
+        self.calls = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.queued_seconds = 0.0
+        self.throttled_seconds = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queued_seconds": round(self.queued_seconds, 3),
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+
+class FairScheduler:
+    """Shares a fixed number of upstream call slots fairly between clients.
+
+    Interactive calls always go ahead of batch ones. Within a class, clients
+    with calls waiting take turns by deficit round robin, so one with
+    thousands of queued calls gets the same share as one with a single call.
+    Metered clients are also held to a per-client token bucket before they
+    queue.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        rate: float = 0,
+        burst: int = 1,
+        quantum: int = 1,
+        max_clients: int = 1000,
+    ):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.limit = limit
+        self.rate = rate
+        self.burst = burst
+        self.quantum = quantum
+        self.max_clients = max_clients
+        self.active = 0
+        self.waiting = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Per class: client name -> its waiters, and the turn order of clients
+        self._queues: list[dict[str, deque]] = [{}, {}]
+        self._rings: list[deque[str]] = [deque(), deque()]
+        self._deficits: dict[str, int] = {}
+        self._limiters: OrderedDict[str, RateLimiter] = OrderedDict()
+        self._usage: OrderedDict[str, ClientUsage] = OrderedDict()
+
+    def usage(self, name: str) -> ClientUsage:
+        """Returns a client's counters, forgetting the least recently seen client when full."""
+        usage = self._usage.get(name)
+        if usage is None:
+            usage = self._usage[name] = ClientUsage()
+            if len(self._usage) > self.max_clients:
+                self._usage.popitem(last=False)
+        self._usage.move_to_end(name)
+        return usage
+
+    def _limiter(self, name: str) -> RateLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = self._limiters[name] = RateLimiter(self.rate, self.burst)
+            if len(self._limiters) > self.max_clients:
+                self._limiters.popitem(last=False)
+        self._limiters.move_to_end(name)
+        return limiter
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Slots and waiters left on a finished loop will never be released
+            self._loop = loop
+            self.active = self.waiting = 0
+            self._queues = [{}, {}]
+            self._rings = [deque(), deque()]
+            self._deficits.clear()
+            self._limiters.clear()
+
+    async def acquire(self, client: Client, cost: int = 1) -> None:
+        """Waits for the client's turn at an upstream call slot."""
+        self._bind_loop()
+        usage = self.usage(client.name)
+        if client.metered and self.rate > 0:
+            started = time.monotonic()
+            await self._limiter(client.name).wait()
+            usage.throttled_seconds += time.monotonic() - started
+
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+        else:
+            waiter = self._loop.create_future()
+            queue = self._queues[client.priority].get(client.name)
+            if queue is None:
+                queue = self._queues[client.priority][client.name] = deque()
+                self._rings[client.priority].append(client.name)
+            queue.append((waiter, cost))
+            self.waiting += 1
+            usage.waiting += 1
+            started = time.monotonic()
+            self._dispatch()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just as we were cancelled; pass the slot on
+                    self._release_slot()
+                else:
+                    waiter.cancel()
+                raise
+            finally:
+                usage.waiting -= 1
+                usage.queued_seconds += time.monotonic() - started
+        usage.calls += 1
+        usage.in_flight += 1
+
+    def release(self, client: Client) -> None:
+        """Frees a slot taken by acquire, handing it to the next client in turn."""
+        usage = self._usage.get(client.name)
+        if usage is not None:
+            usage.in_flight -= 1
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.active = max(0, self.active - 1)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.limit:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.active += 1
+            waiter.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority, ring in enumerate(self._rings):
+            queues = self._queues[priority]
+            while ring:
+                name = ring[0]
+                queue = queues[name]
+                while queue and queue[0][0].done():
+                    # Cancelled while waiting
+                    queue.popleft()
+                    self.waiting -= 1
+                if not queue:
+                    # Idle clients don't bank credit for later
+                    ring.popleft()
+                    del queues[name]
+                    self._deficits.pop(name, None)
+                    continue
+                waiter, cost = queue[0]
+                deficit = self._deficits.get(name, 0)
+                if deficit >= cost:
+                    self._deficits[name] = deficit - cost
+                    queue.popleft()
+                    self.waiting -= 1
+                    return waiter
+                # Its turn is over; top it up for the next one
+                self._deficits[name] = deficit + self.quantum
+                ring.rotate(-1)
+        return None
+
+    def stats(self) -> dict:
+        clients = sorted(
+            self._usage.items(), key=lambda item: item[1].calls, reverse=True
+        )
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rate": self.rate,
+            "burst": self.burst,
+            "clients": {name: usage.snapshot() for name, usage in clients},
+        }
+
+
+_scheduler: Optional[FairScheduler] = None
+
+
+def get_scheduler() -> Optional[FairScheduler]:
+    """Returns the shared scheduler, or None when NBNCHECKER_FAIR_CONCURRENCY is 0."""
+    global _scheduler
+    if _scheduler is None:
+        limit = int(
+            os.environ.get(
+                "NBNCHECKER_FAIR_CONCURRENCY",
+                os.environ.get("NBNCHECKER_UPSTREAM_CONNECTIONS", "10"),
+            )
+        )
+        if limit < 1:
+            return None
+        _scheduler = FairScheduler(
+            limit,
+            rate=float(os.environ.get("NBNCHECKER_CLIENT_RATE", "10")),
+            burst=int(os.environ.get("NBNCHECKER_CLIENT_BURST", "50")),
+        )
+    return _scheduler
+
+
+class ClientIdentityMiddleware:
+    """Tags each request with its client and scheduling class.
+
+    Clients are identified by an X-API-Key header if it is one of
+    `api_keys` (hashed, so keys don't show up in metrics), or else by IP
+    address. Requests on the interactive routes are scheduled ahead of
+    everything else.
+    """
+
+    def __init__(
+        self,
+        app: "ASGIApp",
+        interactive_routes: Iterable[tuple[str, str]],
+        ip_header: Optional[str] = None,
+        api_keys: Iterable[str] = (),
+    ):
+        self.app = app
+        self.interactive_routes = {
+            (method.upper(), path) for method, path in interactive_routes
+        }
+        # Only trust a forwarded-for header when a proxy is known to set it
+        self.ip_header = ip_header.lower().encode() if ip_header else None
+        # Only issued keys name a client; anyone could make up a new key per
+        # request to get a fresh quota and turn
+        self.api_keys = {key.strip().encode() for key in api_keys if key.strip()}
+
+    def identify(self, scope: "Scope") -> str:
+        headers = dict(scope["headers"])
+        api_key = headers.get(b"x-api-key")
+        if api_key and api_key in self.api_keys:
+            return "key:" + hashlib.sha256(api_key).hexdigest()[:12]
+        address = None
+        if self.ip_header and headers.get(self.ip_header):
+            # The proxy in front of us appends the address it saw last
+            address = headers[self.ip_header].decode("latin-1").split(",")[-1].strip()
+        if not address and scope.get("client"):
+            address = scope["client"][0]
+        return f"ip:{address or 'unknown'}"
+
+    async def __call__(self, scope: "Scope", receive: "Receive", send: "Send") -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        interactive = (scope["method"], scope["path"]) in self.interactive_routes
+        client = Client(self.identify(scope), INTERACTIVE if interactive else BATCH)
+        scheduler = get_scheduler()
+        if scheduler is not None:
+            scheduler.usage(client.name).requests += 1
+        token = client_var.set(client)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            client_var.reset(token)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from logconfig import get_logger
+
+logger = get_logger("history")
+
+# Details fields tracked over time, and the column each is stored in
+FIELDS = {
+    "techType": "tech",
+    "serviceStatus": "status",
+    "patChangeDate": "pat",
+}
+
+# Queue marker asking the writer to stop batching and write immediately
+_FLUSH = object()
+
+# Observations only store the fields that changed since the previous one.
+# Strings are interned into `strings`, LOC IDs into `locs`, and a NULL
+# column means "unchanged"; a genuinely missing value is stored as code 0.
+# The partial indexes cover only real changes, so "what changed in this
+# date range" queries don't touch the (much larger) initial observations.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS locs (
+    id INTEGER PRIMARY KEY,
+    loc_id TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS latest (
+    loc INTEGER PRIMARY KEY,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    tech INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    pat INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS observations (
+    loc INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    initial INTEGER NOT NULL,
+    tech INTEGER,
+    status INTEGER,
+    pat INTEGER,
+    PRIMARY KEY (loc, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tech_changes ON observations (ts, loc)
+    WHERE tech IS NOT NULL AND initial = 0;
+CREATE INDEX IF NOT EXISTS status_changes ON observations (ts, loc)
+    WHERE status IS NOT NULL AND initial = 0;
+CREATE INDEX IF NOT EXISTS pat_changes ON observations (ts, loc)
+    WHERE pat IS NOT NULL AND initial = 0;
+"""
+
+
+def _to_epoch(value: str, end_of_day: bool = False) -> int:
+    """Parses an ISO date or datetime (UTC if naive) to epoch seconds.
+
+    With `end_of_day`, a bare date means the last second of that day, so it
+    can be used as an inclusive upper bound.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    epoch = int(parsed.timestamp())
+    if end_of_day:
+        try:
+            date.fromisoformat(value)
+        except ValueError:
+            return epoch
+        return epoch + 86399
+    return epoch
+
+
+def _to_iso(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+class HistoryArchive:
+    """Append-only archive of LOC ID details, recording only changes.
+
+    record() just enqueues; a background thread batches the writes so
+    callers on the event loop never wait on SQLite.
+    """
+
+    def __init__(
+        self, path: str, batch_size: int = 500, flush_interval: float = 1.0
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._load_strings()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._flushed = threading.Condition()
+        self._pending = 0
+        self._writer = threading.Thread(
+            target=self._write_loop, name="history-writer", daemon=True
+        )
+        self._writer.start()
+
+    def record(
+        self, loc_id: str, details: dict, observed_at: Optional[float] = None
+    ) -> None:
+        """Queues one details result for archiving."""
+        values = tuple(details.get(field) for field in FIELDS)
+        with self._flushed:
+            self._pending += 1
+        self._queue.put((loc_id, int(observed_at or time.time()), values))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until everything queued so far has been written."""
+        self._queue.put(_FLUSH)
+        with self._flushed:
+            return self._flushed.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self) -> None:
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._conn.close()
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if item is _FLUSH:
+                continue
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                if item is _FLUSH:
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception(
+                    "Failed to archive history batch",
+                    extra={"event": "history_error", "size": len(batch)},
+                )
+            with self._flushed:
+                self._pending -= len(batch)
+                self._flushed.notify_all()
+
+    def _load_strings(self) -> None:
+        rows = self._conn.execute("SELECT value, id FROM strings").fetchall()
+        self._strings: dict[str, int] = dict(rows)
+        self._values: dict[int, str] = {code: value for value, code in rows}
+
+    def _code(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        code = self._strings.get(value)
+        if code is None:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO strings (value) VALUES (?)", (value,)
+            )
+            code = self._conn.execute(
+                "SELECT id FROM strings WHERE value = ?", (value,)
+            ).fetchone()[0]
+            self._strings[value] = code
+            self._values[code] = value
+        return code
+
+    def _loc(self, loc_id: str) -> int:
+        self._conn.execute(
+            "INSERT OR IGNORE INTO locs (loc_id) VALUES (?)", (loc_id,)
+        )
+        return self._conn.execute(
+            "SELECT id FROM locs WHERE loc_id = ?", (loc_id,)
+        ).fetchone()[0]
+
+    def _write(self, batch: list[tuple[str, int, tuple]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for loc_id, ts, values in batch:
+                    self._write_one(loc_id, ts, values)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                # Interned codes may have been rolled back with the transaction
+                self._load_strings()
+                raise
+
+    def _write_one(self, loc_id: str, ts: int, values: tuple) -> None:
+        loc = self._loc(loc_id)
+        codes = tuple(self._code(value) for value in values)
+        previous = self._conn.execute(
+            "SELECT last_seen, tech, status, pat FROM latest WHERE loc = ?", (loc,)
+        ).fetchone()
+
+        if previous is None:
+            self._conn.execute(
+                "INSERT INTO observations (loc, ts, initial, tech, status, pat) "
+                "VALUES (?, ?, 1, ?, ?, ?)",
+                (loc, ts, *codes),
+            )
+            self._conn.execute(
+                "INSERT INTO latest (loc, first_seen, last_seen, tech, status, pat) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (loc, ts, ts, *codes),
+            )
+            return
+
+        last_seen, *previous_codes = previous
+        if ts < last_seen:
+            # Out-of-order observation: the archive only moves forward
+            return
+        delta = [
+            code if code != old else None
+            for code, old in zip(codes, previous_codes)
+        ]
+        if any(code is not None for code in delta):
+            self._conn.execute(
+                "INSERT INTO observations (loc, ts, initial, tech, status, pat) "
+                "VALUES (?, ?, 0, ?, ?, ?) ON CONFLICT (loc, ts) DO UPDATE SET "
+                "tech = coalesce(excluded.tech, tech), "
+                "status = coalesce(excluded.status, status), "
+                "pat = coalesce(excluded.pat, pat)",
+                (loc, ts, *delta),
+            )
+        self._conn.execute(
+            "UPDATE latest SET last_seen = ?, tech = ?, status = ?, pat = ? "
+            "WHERE loc = ?",
+            (ts, *codes, loc),
+        )
+
+    def _decode(self, code: Optional[int]) -> Optional[str]:
+        if not code:
+            return None
+        if code not in self._values:
+            # Interned by another process sharing the file
+            self._load_strings()
+        return self._values.get(code)
+
+    def history(self, loc_id: str) -> Optional[dict]:
+        """Returns every recorded state of a LOC ID, oldest first."""
+        with self._lock:
+            loc = self._conn.execute(
+                "SELECT l.id, t.first_seen, t.last_seen FROM locs l "
+                "JOIN latest t ON t.loc = l.id WHERE l.loc_id = ?",
+                (loc_id,),
+            ).fetchone()
+            if loc is None:
+                return None
+            loc, first_seen, last_seen = loc
+            rows = self._conn.execute(
+                "SELECT ts, tech, status, pat FROM observations WHERE loc = ? "
+                "ORDER BY ts",
+                (loc,),
+            ).fetchall()
+            state: dict = {}
+            changes = []
+            for ts, *codes in rows:
+                changed = []
+                for field, code in zip(FIELDS, codes):
+                    if code is not None:
+                        state[field] = self._decode(code)
+                        changed.append(field)
+                changes.append(
+                    {"observedAt": _to_iso(ts), **state, "changed": changed}
+                )
+        return {
+            "locID": loc_id,
+            "firstSeen": _to_iso(first_seen),
+            "lastSeen": _to_iso(last_seen),
+            "history": changes,
+        }
+
+    def changes(
+        self,
+        field: str,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        limit: int = 1000,
+    ) -> list[dict]:
+        """Lists premises whose `field` changed within [since, until]."""
+        column = FIELDS[field]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT l.loc_id, o.ts, o.{column}, ("
+                f"SELECT p.{column} FROM observations p WHERE p.loc = o.loc "
+                f"AND p.ts < o.ts AND p.{column} IS NOT NULL "
+                f"ORDER BY p.ts DESC LIMIT 1) "
+                f"FROM observations o INDEXED BY {column}_changes "
+                f"JOIN locs l ON l.id = o.loc "
+                f"WHERE o.{column} IS NOT NULL AND o.initial = 0 "
+                f"AND o.ts >= ? AND o.ts <= ? ORDER BY o.ts, o.loc LIMIT ?",
+                (since or 0, until or 2**62, limit),
+            ).fetchall()
+            return [
+                {
+                    "locID": loc_id,
+                    "changedAt": _to_iso(ts),
+                    "from": self._decode(old),
+                    "to": self._decode(new),
+                }
+                for loc_id, ts, new, old in rows
+            ]
+
+
+_archive: Optional[HistoryArchive] = None
+
+
+def get_archive() -> Optional[HistoryArchive]:
+    """Returns the configured archive, or None if NBNCHECKER_HISTORY_DB is unset."""
+    global _archive
+    path = os.environ.get("NBNCHECKER_HISTORY_DB")
+    if not path:
+        return None
+    if _archive is None or _archive.path != path:
+        _archive = HistoryArchive(path)
+    return _archive
+
+
+def record_details(loc_id: Optional[str], details: Optional[dict]) -> None:
+    """Archives a details result if the archive is enabled."""
+    archive = get_archive()
+    if archive is not None and loc_id and details:
+        archive.record(loc_id, details)
+
+
+def close_archive() -> None:
+    """Flushes and closes the archive, if one was opened."""
+    global _archive
+    if _archive is not None:
+        _archive.close()
+        _archive = None
+
+
+router = APIRouter(prefix="/api/history")
+
+
+def _require_archive() -> HistoryArchive:
+    archive = get_archive()
+    if archive is None:
+        raise HTTPException(
+            status_code=503, detail="The history archive is not configured"
+        )
+    return archive
+
+
+@router.get("/changes")
+async def history_changes(
+    field: str = "techType",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 1000,
+):
+    """Lists premises whose field changed in the given date range."""
+    archive = _require_archive()
+    if field not in FIELDS:
+        raise HTTPException(
+            status_code=400, detail=f"field must be one of {', '.join(FIELDS)}"
+        )
+    try:
+        since_epoch = _to_epoch(since) if since else None
+        until_epoch = _to_epoch(until, end_of_day=True) if until else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
+    limit = max(1, min(limit, 10000))
+    return await asyncio.to_thread(
+        archive.changes, field, since_epoch, until_epoch, limit
+    )
+
+
+@router.get("/{loc_id}")
+async def loc_history(loc_id: str):
+    """Returns the recorded history of a LOC ID."""
+    archive = _require_archive()
+    history = await asyncio.to_thread(archive.history, loc_id.strip().upper())
+    if history is None:
+        raise HTTPException(status_code=404, detail="No history for this LOC ID")
+    return history
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+import asyncio
+import csv
+import io
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from api import nbnLocDetailsFetchAsync, nbnQueryAddressAsync
+from cache import CacheBackend, cache_key, get_cache
+from fairqueue import BATCH, Client, client_var
+from history import record_details
+from logconfig import get_logger
+
+logger = get_logger("jobs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    total INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    chunks INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_claimable ON chunks (status, lease_expires);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, row)
+) WITHOUT ROWID;
+"""
+
+
+class JobStore:
+    """SQLite-backed job queue shared by every app process on the host.
+
+    Chunks are claimed under a lease inside an IMMEDIATE transaction, so
+    several processes can pull from the same file without double-processing.
+    Workers renew the lease while they work, and only the current lease
+    holder can complete a chunk. Chunks held by a process that died are
+    picked up again once their lease expires, up to `max_attempts` times,
+    after which their unprocessed rows are marked as failed.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def submit(self, addresses: list[str], chunk_size: int = 100) -> str:
+        """Stores a new job and returns its ID."""
+        if not addresses:
+            raise ValueError("A job needs at least one address")
+        job_id = uuid.uuid4().hex
+        chunks = (len(addresses) + chunk_size - 1) // chunk_size
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, created_at, total, chunk_size, chunks) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (job_id, time.time(), len(addresses), chunk_size, chunks),
+                )
+                self._conn.executemany(
+                    "INSERT INTO chunks (job_id, idx) VALUES (?, ?)",
+                    ((job_id, idx) for idx in range(chunks)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO items (job_id, row, address) VALUES (?, ?, ?)",
+                    (
+                        (job_id, row, address)
+                        for row, address in enumerate(addresses)
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self, owner: str) -> Optional[tuple[str, int, list[tuple[int, str]]]]:
+        """Leases the oldest available chunk, returning (job_id, idx, rows)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._abandon_exhausted(now)
+                claimed = self._conn.execute(
+                    "SELECT c.job_id, c.idx, j.chunk_size FROM chunks c "
+                    "JOIN jobs j ON j.id = c.job_id "
+                    "WHERE c.status = 'pending' "
+                    "OR (c.status = 'running' AND c.lease_expires < ?) "
+                    "ORDER BY j.created_at, c.idx LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if claimed is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, idx, chunk_size = claimed
+                self._conn.execute(
+                    "UPDATE chunks SET status = 'running', lease_owner = ?, "
+                    "lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND idx = ?",
+                    (owner, now + self.lease_seconds, job_id, idx),
+                )
+                rows = self._conn.execute(
+                    "SELECT row, address FROM items WHERE job_id = ? "
+                    "AND row >= ? AND row < ? ORDER BY row",
+                    (job_id, idx * chunk_size, (idx + 1) * chunk_size),
+                ).fetchall()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id, idx, rows
+
+    def _abandon_exhausted(self, now: float) -> None:
+        # Called inside a transaction: gives up on expired chunks that have
+        # already used every attempt, so a chunk can't be retried forever
+        exhausted = self._conn.execute(
+            "SELECT c.job_id, c.idx, j.chunk_size FROM chunks c "
+            "JOIN jobs j ON j.id = c.job_id "
+            "WHERE c.status = 'running' AND c.lease_expires < ? "
+            "AND c.attempts >= ?",
+            (now, self.max_attempts),
+        ).fetchall()
+        for job_id, idx, chunk_size in exhausted:
+            self._conn.execute(
+                "UPDATE items SET error = ? WHERE job_id = ? "
+                "AND row >= ? AND row < ? AND result IS NULL AND error IS NULL",
+                (
+                    f"Gave up after {self.max_attempts} attempts",
+                    job_id,
+                    idx * chunk_size,
+                    (idx + 1) * chunk_size,
+                ),
+            )
+            self._conn.execute(
+                "UPDATE chunks SET status = 'failed', lease_owner = NULL, "
+                "lease_expires = NULL WHERE job_id = ? AND idx = ?",
+                (job_id, idx),
+            )
+            self._finish_job(job_id)
+
+    def _finish_job(self, job_id: str) -> None:
+        self._conn.execute(
+            "UPDATE jobs SET finished_at = ? WHERE id = ? "
+            "AND finished_at IS NULL AND NOT EXISTS "
+            "(SELECT 1 FROM chunks WHERE job_id = ? "
+            "AND status NOT IN ('done', 'failed'))",
+            (time.time(), job_id, job_id),
+        )
+
+    def renew(self, job_id: str, idx: int, owner: str) -> bool:
+        """Extends a held lease, returning False if `owner` no longer holds it."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE chunks SET lease_expires = ? WHERE job_id = ? AND idx = ? "
+                "AND status = 'running' AND lease_owner = ?",
+                (time.time() + self.lease_seconds, job_id, idx, owner),
+            )
+        return cursor.rowcount > 0
+
+    def complete(
+        self,
+        job_id: str,
+        idx: int,
+        owner: str,
+        results: list[tuple[int, Optional[dict], Optional[str]]],
+    ) -> bool:
+        """Saves a chunk's (row, result, error) triples and marks it done.
+
+        Returns False, saving nothing, if `owner` has lost the lease.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "UPDATE chunks SET status = 'done', lease_owner = NULL, "
+                    "lease_expires = NULL WHERE job_id = ? AND idx = ? "
+                    "AND status = 'running' AND lease_owner = ?",
+                    (job_id, idx, owner),
+                )
+                if cursor.rowcount == 0:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                self._conn.executemany(
+                    "UPDATE items SET result = ?, error = ? "
+                    "WHERE job_id = ? AND row = ?",
+                    (
+                        (
+                            json.dumps(result) if result is not None else None,
+                            error,
+                            job_id,
+                            row,
+                        )
+                        for row, result, error in results
+                    ),
+                )
+                self._finish_job(job_id)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def release(self, job_id: str, idx: int, owner: str) -> None:
+        """Returns a leased chunk to the queue so another worker can retry it.
+
+        A chunk handed back on shutdown doesn't count as a failed attempt.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE chunks SET status = 'pending', lease_owner = NULL, "
+                "lease_expires = NULL, attempts = attempts - 1 "
+                "WHERE job_id = ? AND idx = ? AND status = 'running' "
+                "AND lease_owner = ?",
+                (job_id, idx, owner),
+            )
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """Returns progress counters for a job, or None if it doesn't exist."""
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT created_at, finished_at, total, chunks FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if job is None:
+                return None
+            chunk_counts = dict(
+                self._conn.execute(
+                    "SELECT status, COUNT(*) FROM chunks WHERE job_id = ? "
+                    "GROUP BY status",
+                    (job_id,),
+                ).fetchall()
+            )
+            processed, failed = self._conn.execute(
+                "SELECT COUNT(result) + COUNT(error), COUNT(error) FROM items "
+                "WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        created_at, finished_at, total, chunks = job
+        if finished_at:
+            status = "done"
+        elif processed or chunk_counts.get("running"):
+            status = "running"
+        else:
+            status = "pending"
+        return {
+            "id": job_id,
+            "status": status,
+            "created_at": created_at,
+            "finished_at": finished_at,
+            "total": total,
+            "processed": processed,
+            "failed": failed,
+            "chunks": {
+                "total": chunks,
+                "done": chunk_counts.get("done", 0),
+                "running": chunk_counts.get("running", 0),
+                "pending": chunk_counts.get("pending", 0),
+                "failed": chunk_counts.get("failed", 0),
+            },
+        }
+
+    def results(
+        self, job_id: str, offset: int = 0, limit: int = 1000
+    ) -> list[dict]:
+        """Returns a page of processed rows, in input order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row, address, result, error FROM items "
+                "WHERE job_id = ? AND row >= ? "
+                "AND (result IS NOT NULL OR error IS NOT NULL) "
+                "ORDER BY row LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        return [
+            {
+                "row": row,
+                "address": address,
+                "result": json.loads(result) if result is not None else None,
+                "error": error,
+            }
+            for row, address, result, error in rows
+        ]
+
+    def iter_results(self, job_id: str, page_size: int = 1000) -> Iterator[dict]:
+        """Yields every processed row, a page at a time."""
+        offset = 0
+        while page := self.results(job_id, offset, page_size):
+            yield from page
+            offset = page[-1]["row"] + 1
+
+
+async def lookup(address: str) -> dict:
+    """Resolves one address (or LOC ID) to its location details."""
+    address = address.strip()
+    if address.upper().startswith("LOC"):
+        loc_id = address.upper()
+        selected_address = None
+    else:
+        query = await nbnQueryAddressAsync(address)
+        if not query["validResult"]:
+            return {"selectedAddress": None, "locID": None, "details": None}
+        loc_id = query["locID"]
+        selected_address = query["selectedAddress"]
+    details, fetched = await nbnLocDetailsFetchAsync(loc_id)
+    if fetched:
+        # Cached details were archived when they were fetched
+        record_details(loc_id, details)
+    return {
+        "selectedAddress": selected_address,
+        "locID": loc_id,
+        "details": details,
+    }
+
+
+async def prefetch(cache: CacheBackend, addresses: list[str]) -> None:
+    """Reads a chunk's cached responses from the shared cache up front.
+
+    The autocomplete responses for addresses and the details of LOC IDs come
+    in one round trip, then the details of the LOC IDs those autocomplete
+    responses resolve to in a second, instead of one round trip per lookup.
+    """
+    addresses = [address.strip() for address in addresses]
+    queries = [a for a in addresses if not a.upper().startswith("LOC")]
+    loc_ids = [a.upper() for a in addresses if a.upper().startswith("LOC")]
+    found = await cache.prefetch(
+        [cache_key("autocomplete", query) for query in queries]
+        + [cache_key("details", loc_id) for loc_id in loc_ids]
+    )
+    resolved = []
+    for response in found[: len(queries)]:
+        suggestions = (response or {}).get("suggestions") or []
+        # lookup() takes the first suggestion, if it's a premises
+        if suggestions and suggestions[0].get("id", "").startswith("LOC"):
+            resolved.append(suggestions[0]["id"])
+    if resolved:
+        await cache.prefetch([cache_key("details", loc_id) for loc_id in resolved])
+
+
+class JobWorker:
+    """Pulls chunks from the store and processes them with bounded concurrency."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        name: str,
+        concurrency: int = 5,
+        poll_interval: float = 2.0,
+    ):
+        self.store = store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{name}"
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+
+    async def process_chunk(
+        self, rows: list[tuple[int, str]], job_id: Optional[str] = None
+    ) -> list[tuple[int, Optional[dict], Optional[str]]]:
+        # Jobs queue behind interactive lookups and share upstream capacity
+        # fairly with each other; their pace is already set by the worker pool
+        token = client_var.set(Client(f"job:{job_id}", BATCH, metered=False))
+        cache = get_cache()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(row: int, address: str):
+            async with semaphore:
+                try:
+                    return row, await lookup(address), None
+                except Exception as e:
+                    return row, None, str(e)
+
+        try:
+            if cache is not None:
+                await prefetch(cache, [address for _, address in rows])
+            return await asyncio.gather(
+                *(run(row, address) for row, address in rows)
+            )
+        finally:
+            client_var.reset(token)
+
+    async def _heartbeat(self, job_id: str, idx: int, work: asyncio.Task) -> None:
+        # Renew well before expiry; stop the work if the lease was lost anyway
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            if not await asyncio.to_thread(
+                self.store.renew, job_id, idx, self.owner
+            ):
+                work.cancel()
+                return
+
+    async def run_once(self) -> bool:
+        """Processes a single chunk, returning False if there was nothing to do."""
+        claimed = await asyncio.to_thread(self.store.claim, self.owner)
+        if claimed is None:
+            return False
+        job_id, idx, rows = claimed
+        work = asyncio.ensure_future(self.process_chunk(rows, job_id))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, idx, work))
+        try:
+            results = await work
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                await asyncio.to_thread(self.store.release, job_id, idx, self.owner)
+                raise
+            results = None
+        except BaseException:
+            await asyncio.to_thread(self.store.release, job_id, idx, self.owner)
+            raise
+        finally:
+            heartbeat.cancel()
+        if results is None or not await asyncio.to_thread(
+            self.store.complete, job_id, idx, self.owner, results
+        ):
+            logger.warning(
+                "Job chunk lease lost; leaving it to its new owner",
+                extra={"event": "job_lease_lost", "job_id": job_id, "chunk": idx},
+            )
+            return True
+        logger.info(
+            "Job chunk processed",
+            extra={
+                "event": "job_chunk",
+                "job_id": job_id,
+                "chunk": idx,
+                "rows": len(rows),
+            },
+        )
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker error", extra={"event": "job_error"})
+            await asyncio.sleep(self.poll_interval)
+
+
+_store: Optional[JobStore] = None
+
+
+def get_store() -> Optional[JobStore]:
+    """Returns the configured store, or None when NBNCHECKER_JOBS_DB is unset."""
+    global _store
+    path = os.environ.get("NBNCHECKER_JOBS_DB")
+    if not path:
+        return None
+    if _store is None or _store.path != path:
+        _store = JobStore(
+            path,
+            lease_seconds=float(os.environ.get("NBNCHECKER_JOB_LEASE", "300")),
+            max_attempts=int(os.environ.get("NBNCHECKER_JOB_MAX_ATTEMPTS", "3")),
+        )
+    return _store
+
+
+def start_workers() -> list[asyncio.Task]:
+    """Starts this process's share of the worker pool, if jobs are enabled."""
+    store = get_store()
+    if store is None:
+        return []
+    count = int(os.environ.get("NBNCHECKER_JOB_WORKERS", "2"))
+    concurrency = int(os.environ.get("NBNCHECKER_JOB_CONCURRENCY", "5"))
+    return [
+        asyncio.create_task(JobWorker(store, str(n), concurrency).run())
+        for n in range(count)
+    ]
+
+
+router = APIRouter(prefix="/api/jobs")
+
+
+def _require_store() -> JobStore:
+    store = get_store()
+    if store is None:
+        raise HTTPException(status_code=503, detail="The job queue is not configured")
+    return store
+
+
+def _require_job(store: JobStore, job_id: str) -> dict:
+    status = store.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+
+@router.post("", status_code=202)
+async def submit_job(request: Request):
+    """Accepts a JSON {"addresses": [...]} body or one address per line as text."""
+    store = _require_store()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            # Malformed JSON, or not UTF-8 at all
+            body = None
+        addresses = body.get("addresses") if isinstance(body, dict) else None
+        if not isinstance(addresses, list) or not all(
+            isinstance(address, str) for address in addresses
+        ):
+            raise HTTPException(
+                status_code=422, detail="Expected {\"addresses\": [\"...\"]}"
+            )
+    else:
+        try:
+            addresses = (await request.body()).decode().splitlines()
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=422, detail="Expected UTF-8 text with one address per line"
+            )
+    addresses = [address.strip() for address in addresses if address.strip()]
+    if not addresses:
+        raise HTTPException(status_code=422, detail="No addresses were supplied")
+
+    chunk_size = int(os.environ.get("NBNCHECKER_JOB_CHUNK_SIZE", "100"))
+    job_id = await asyncio.to_thread(store.submit, addresses, chunk_size)
+    logger.info(
+        "Job submitted",
+        extra={"event": "job_submitted", "job_id": job_id, "total": len(addresses)},
+    )
+    return {"id": job_id, "total": len(addresses), "status_url": f"/api/jobs/{job_id}"}
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    """Returns a job's progress."""
+    store = _require_store()
+    return await asyncio.to_thread(_require_job, store, job_id)
+
+
+@router.get("/{job_id}/results")
+async def job_results(job_id: str, offset: int = 0, limit: int = 1000):
+    """Returns processed rows so far, starting at input row `offset`."""
+    store = _require_store()
+    await asyncio.to_thread(_require_job, store, job_id)
+    limit = max(1, min(limit, 10000))
+    return await asyncio.to_thread(store.results, job_id, offset, limit)
+
+
+@router.get("/{job_id}/download")
+async def job_download(job_id: str, format: str = "ndjson"):
+    """Streams every processed row as NDJSON or CSV."""
+    store = _require_store()
+    await asyncio.to_thread(_require_job, store, job_id)
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+    def ndjson():
+        for item in store.iter_results(job_id):
+            yield json.dumps(item) + "\n"
+
+    def to_csv():
+        fields = [
+            "row", "address", "selectedAddress", "locID", "exactMatch",
+            "techType", "serviceStatus", "patChangeDate", "csaID", "error",
+        ]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for item in store.iter_results(job_id):
+            result = item["result"] or {}
+            writer.writerow({
+                "row": item["row"],
+                "address": item["address"],
+                "selectedAddress": result.get("selectedAddress"),
+                "locID": result.get("locID"),
+                **(result.get("details") or {}),
+                "error": item["error"],
+            })
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if format == "csv":
+        return StreamingResponse(
+            to_csv(),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{job_id}.csv"'},
+        )
+    return StreamingResponse(
+        ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.ndjson"'},
+    )
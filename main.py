@@ -1,18 +1,130 @@
 #!/usr/bin/env python3
-import uvicorn
+import asyncio
 import json
-import requests
-from fastapi import FastAPI, Request, Form
+import os
+import time
+import upstream
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Request, Form
 from pathlib import Path
 from typing import Optional
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 # from fastapi.staticfiles import StaticFiles
+from admission import AdmissionController, AdmissionControlMiddleware
+from api import cachedFetch
+from cache import close_cache, get_cache
+from contentencoding import CompressionMiddleware
+from diagnostics import ProfilingMiddleware, require_admin, router as diagnostics_router
+from fairqueue import ClientIdentityMiddleware, get_scheduler
+from history import close_archive, record_details, router as history_router
+from jobs import router as jobs_router, start_workers
+import servingarea
+from logconfig import RequestIdMiddleware, configure_logging, get_logger, stop_logging
 
-app = FastAPI()
+logger = get_logger("main")
 
-# Configure templates
-templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging()
+    workers = start_workers()
+    if os.environ.get("NBNCHECKER_UPSTREAM_PREWARM", "2") != "0":
+        # Open upstream connections now and keep them open while idle
+        workers.append(asyncio.create_task(upstream.keep_warm()))
+    # Load templates now (from the build-time bytecode cache when present)
+    # so the first request doesn't pay for it
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
+    app.state.ready = True
+    logger.info("Ready", extra={"event": "ready"})
+    yield
+    # Fail readiness first so load balancers stop routing here while we drain
+    app.state.ready = False
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await upstream.close()
+    await close_cache()
+    close_archive()
+    stop_logging()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
+app.include_router(diagnostics_router)
+app.include_router(jobs_router)
+app.include_router(history_router)
+
+# Admin-only per-request profiling of lookups (?profile=1 or X-Profile header)
+app.add_middleware(ProfilingMiddleware, routes=[("POST", "/"), ("POST", "/compare")])
+
+# Admission control for the lookup routes: a bounded number of lookups run at
+# once, a short queue absorbs bursts, and anything beyond that gets a fast 503
+admission = AdmissionController(
+    limit=int(os.environ.get("NBNCHECKER_MAX_CONCURRENT_LOOKUPS", "16")),
+    queue_size=int(os.environ.get("NBNCHECKER_LOOKUP_QUEUE_SIZE", "32")),
+    queue_timeout=float(os.environ.get("NBNCHECKER_LOOKUP_QUEUE_TIMEOUT", "2")),
+)
+app.add_middleware(
+    AdmissionControlMiddleware,
+    controller=admission,
+    routes=[("POST", "/"), ("POST", "/compare")],
+    retry_after=int(os.environ.get("NBNCHECKER_LOOKUP_RETRY_AFTER", "1")),
+)
+
+# Crawls hold their slot for the whole stream, which can run for minutes, so
+# they get their own few slots rather than taking lookups' and starving the form
+crawl_admission = AdmissionController(
+    limit=int(os.environ.get("NBNCHECKER_MAX_CONCURRENT_CRAWLS", "2"))
+)
+app.add_middleware(
+    AdmissionControlMiddleware,
+    controller=crawl_admission,
+    routes=[("GET", "/api/crawl")],
+    retry_after=int(os.environ.get("NBNCHECKER_LOOKUP_RETRY_AFTER", "1")),
+)
+
+# Tag requests with their client (API key or IP) so upstream calls are shared
+# fairly between clients, with the form and comparisons ahead of bulk traffic
+app.add_middleware(
+    ClientIdentityMiddleware,
+    interactive_routes=[("POST", "/"), ("POST", "/compare")],
+    ip_header=os.environ.get("NBNCHECKER_CLIENT_IP_HEADER"),
+    api_keys=os.environ.get("NBNCHECKER_API_KEYS", "").split(","),
+)
+
+# Negotiated gzip/zstd compression of HTML, JSON and NDJSON output
+if os.environ.get("NBNCHECKER_COMPRESSION", "1") == "1":
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=int(os.environ.get("NBNCHECKER_COMPRESSION_MIN_SIZE", "512")),
+    )
+
+# Outermost, so every log line for a request (including shed ones) is correlated
+app.add_middleware(RequestIdMiddleware)
+
+# Configure templates. Compiled templates are cached on disk; the image build
+# fills the cache (see precompile.py) so new containers skip compiling them
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+TEMPLATE_CACHE_DIR = Path(
+    os.environ.get(
+        "NBNCHECKER_TEMPLATE_CACHE", Path(__file__).parent / ".template-cache"
+    )
+)
+try:
+    TEMPLATE_CACHE_DIR.mkdir(exist_ok=True)
+    bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+except OSError:
+    bytecode_cache = None
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=True,
+        bytecode_cache=bytecode_cache,
+    )
+)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -23,10 +135,159 @@ async def read_root(request: Request):
 
 @app.get("/health", include_in_schema=False, response_class=JSONResponse)
 async def health_check():
-    """Returns a health status."""
+    """Returns a liveness status."""
     return {"status": "healthy"}
 
 
+@app.get("/health/ready", include_in_schema=False, response_class=JSONResponse)
+async def readiness_check():
+    """Returns 200 once startup has finished, and 503 while starting or stopping."""
+    if not app.state.ready:
+        return JSONResponse({"status": "unavailable"}, status_code=503)
+    return {"status": "ready"}
+
+
+@app.get("/api/upstream/stats")
+async def upstream_stats():
+    """Returns connection reuse and DNS cache counters for the NBN API pool."""
+    return upstream.stats.snapshot()
+
+
+@app.get("/api/csa")
+async def list_serving_areas():
+    """Lists the serving areas seen so far with their premises counts."""
+    serving_areas = servingarea.serving_areas
+    return {"stats": serving_areas.stats(), "areas": serving_areas.summary()}
+
+
+@app.get("/api/csa/{csa_id}")
+async def serving_area(csa_id: str):
+    """Returns the cached details and aggregated premises counts for a CSA."""
+    aggregate = servingarea.serving_areas.aggregate(csa_id.strip().upper())
+    if aggregate is None:
+        raise HTTPException(status_code=404, detail="Serving area not seen yet")
+    return aggregate
+
+
+@app.get("/admin/clients", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def client_usage():
+    """Returns per-client upstream usage and the scheduler's current load."""
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return JSONResponse(
+            {"error": "Fair scheduling is not enabled"}, status_code=503
+        )
+    return scheduler.stats()
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Returns hit, miss and error counters for the response cache."""
+    cache = get_cache()
+    if cache is None:
+        return JSONResponse(
+            {"error": "Response cache is not configured"}, status_code=503
+        )
+    return cache.stats()
+
+
+async def fetch_upstream(kind: str, url: str, params: Optional[dict] = None) -> dict:
+    """Calls an NBN API endpoint, logging the outcome and latency."""
+    started = time.perf_counter()
+    try:
+        response = await upstream.get(url, params=params)
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(
+            "Upstream %s call failed",
+            kind,
+            extra={
+                "event": "upstream_error",
+                "upstream": kind,
+                "url": url,
+                "error": str(e),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+        )
+        raise
+    logger.info(
+        "Upstream %s call",
+        kind,
+        extra={
+            "event": "upstream_call",
+            "upstream": kind,
+            "url": url,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "sampled": True,
+        },
+    )
+    return response.json()
+
+
+async def fetch_details(loc_id: str) -> tuple[dict, bool]:
+    """Returns the raw details response for a LOC ID and whether it was fetched.
+
+    Premises already known to resolve only to a serving area are answered
+    from the cached CSA, and others from the response cache if configured.
+    """
+    return await cachedFetch(
+        "details",
+        loc_id,
+        lambda: fetch_upstream(
+            "details", f"https://places.nbnco.net.au/places/v2/details/{loc_id}"
+        ),
+    )
+
+
+async def fetch_autocomplete(query: str) -> dict:
+    """Returns the raw autocomplete response for an address query."""
+    # Passed as a parameter so "#", "&" and "+" in addresses are encoded
+    address_raw_json, _ = await cachedFetch(
+        "autocomplete",
+        query,
+        lambda: fetch_upstream(
+            "autocomplete",
+            "https://places.nbnco.net.au/places/v1/autocomplete",
+            params={"query": query},
+        ),
+    )
+    return address_raw_json
+
+
+def parse_details(details_raw_json: dict) -> Optional[dict]:
+    """Extracts the fields shown to users from a raw details response."""
+    loc_details_result = {}
+    if (
+        "addressDetail" in details_raw_json
+        and "id" in details_raw_json["addressDetail"]
+    ):
+        address_detail = details_raw_json["addressDetail"]
+        loc_details_result["exactMatch"] = True
+        loc_details_result["locID"] = address_detail["id"]
+        loc_details_result["techType"] = address_detail.get("techType")
+        loc_details_result["serviceStatus"] = address_detail.get("serviceStatus")
+        loc_details_result["statusMessage"] = address_detail.get("statusMessage", "")
+        loc_details_result["coatChangeReason"] = address_detail.get(
+            "coatChangeReason", ""
+        )
+        if loc_details_result["coatChangeReason"]:
+            loc_details_result["patChangeDate"] = address_detail.get(
+                "patChangeDate", ""
+            )
+        else:
+            loc_details_result["patChangeDate"] = ""
+    elif "servingArea" in details_raw_json:
+        loc_details_result["exactMatch"] = False
+        loc_details_result["csaID"] = details_raw_json["servingArea"].get("csaId")
+        loc_details_result["techType"] = details_raw_json["servingArea"].get(
+            "techType"
+        )
+    else:
+        return None
+    return loc_details_result
+
+
 @app.post("/", response_class=HTMLResponse)
 async def check_address(
     request: Request,
@@ -49,7 +310,10 @@ async def check_address(
 
     try:
         if loc_id_selected:
-            print(f"LOC ID selected by user: {loc_id_selected}")
+            logger.info(
+                "LOC ID selected by user",
+                extra={"event": "loc_id_selected", "loc_id": loc_id_selected},
+            )
             loc_id = loc_id_selected.strip().upper()
             # Ensure it still looks like a LOC ID before proceeding
             if loc_id.startswith("LOC"):
@@ -67,19 +331,20 @@ async def check_address(
             # No specific LOC ID selected, proceed with input check (address or direct LOC ID)
             # Check if the input looks like a LOC ID
             if search_input.upper().startswith("LOC"):
-                print(f"Detected LOC ID search: {search_input}")
+                logger.info(
+                    "Direct LOC ID search",
+                    extra={"event": "loc_id_search", "loc_id": search_input},
+                )
                 loc_id = search_input.upper()
                 is_loc_id_search = True
                 selected_address = f"Direct Lookup for {loc_id}"
             else:
                 # Input is an address, perform autocomplete lookup
-                print(f"Performing address search for: {search_input}")
-                address_api_url = f"https://places.nbnco.net.au/places/v1/autocomplete?query={search_input}"
-                address_response = requests.get(
-                    address_api_url, headers={"Referer": "https://www.nbnco.com.au"}
+                logger.info(
+                    "Address search",
+                    extra={"event": "address_search", "address": search_input},
                 )
-                address_response.raise_for_status()
-                address_raw_json = address_response.json()
+                address_raw_json = await fetch_autocomplete(search_input)
 
                 # Filter suggestions to only include valid ones (starting with LOC)
                 valid_suggestions = [
@@ -96,10 +361,16 @@ async def check_address(
                     first_suggestion = valid_suggestions[0]
                     loc_id = first_suggestion["id"]
                     selected_address = first_suggestion.get("formattedAddress")
-                    print(f"Single valid suggestion found: {loc_id}")
+                    logger.info(
+                        "Single valid suggestion found",
+                        extra={"event": "suggestions", "count": 1, "loc_id": loc_id},
+                    )
                 else:
                     # Multiple valid suggestions found
-                    print(f"Multiple valid suggestions found: {len(valid_suggestions)}")
+                    logger.info(
+                        "Multiple valid suggestions found",
+                        extra={"event": "suggestions", "count": len(valid_suggestions)},
+                    )
                     suggestions_list = valid_suggestions
                     loc_id = (
                         None  # Don't proceed to details yet, wait for user selection
@@ -107,63 +378,23 @@ async def check_address(
                     # Keep address_raw_json for potential display if needed
         if loc_id and not suggestions_list:
             # Step 2: Get location details using the locID
-            print(f"Fetching details for LOC ID: {loc_id}")
-            details_api_url = f"https://places.nbnco.net.au/places/v2/details/{loc_id}"
-            details_response = requests.get(
-                details_api_url, headers={"Referer": "https://www.nbnco.com.au"}
-            )
-            details_response.raise_for_status()
-            details_raw_json = details_response.json()
-
-            # Process details_raw_json
-            loc_details_result = {}
-            if (
-                "addressDetail" in details_raw_json
-                and "id" in details_raw_json["addressDetail"]
-            ):
-                loc_details_result["exactMatch"] = True
-                loc_details_result["locID"] = details_raw_json["addressDetail"]["id"]
-                loc_details_result["techType"] = details_raw_json["addressDetail"].get(
-                    "techType"
-                )
-                loc_details_result["serviceStatus"] = details_raw_json[
-                    "addressDetail"
-                ].get("serviceStatus")
-                loc_details_result["statusMessage"] = details_raw_json[
-                    "addressDetail"
-                ].get("statusMessage", "")
-                loc_details_result["coatChangeReason"] = details_raw_json[
-                    "addressDetail"
-                ].get("coatChangeReason", "")
-                if loc_details_result["coatChangeReason"]:
-                    loc_details_result["patChangeDate"] = details_raw_json[
-                        "addressDetail"
-                    ].get("patChangeDate", "")
-                else:
-                    loc_details_result["patChangeDate"] = ""
-
-                # If it was a LOC ID search, try to get the formatted address from details
-                if is_loc_id_search:
-                    selected_address = details_raw_json["addressDetail"].get(
-                        "formattedAddress", selected_address
-                    )
-
-            elif "servingArea" in details_raw_json:
-                loc_details_result["exactMatch"] = False
-                loc_details_result["csaID"] = details_raw_json["servingArea"].get(
-                    "csaId"
-                )
-                loc_details_result["techType"] = details_raw_json["servingArea"].get(
-                    "techType"
-                )
-            else:
+            details_raw_json, details_fetched = await fetch_details(loc_id)
+            loc_details_result = parse_details(details_raw_json)
+            if loc_details_result is None:
                 error_message = (
                     f"Could not retrieve detailed location information for {loc_id}."
                 )
-                loc_details_result = None
+            elif loc_details_result["exactMatch"] and is_loc_id_search:
+                # If it was a LOC ID search, try to get the formatted address from details
+                selected_address = details_raw_json["addressDetail"].get(
+                    "formattedAddress", selected_address
+                )
 
             # Prepare results for the template only if loc_details_result is valid
             if loc_details_result:
+                # Only archive details actually fetched from the NBN API
+                if details_fetched:
+                    record_details(loc_id, loc_details_result)
                 results_data = {
                     "selectedAddress": selected_address,
                     "loc_details": loc_details_result,
@@ -183,7 +414,9 @@ async def check_address(
             error_message = "Failed to determine LOC ID from the provided address."
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.exception(
+            "Lookup failed", extra={"event": "lookup_error", "loc_id": loc_id}
+        )
         if is_loc_id_search:
             error_message = f"Failed to retrieve details for {loc_id}. It might be invalid or not found. Error: {e}"
         else:
@@ -196,6 +429,112 @@ async def check_address(
     return templates.TemplateResponse(request, "index.html", context)
 
 
+async def compare_one(entry: str) -> dict:
+    """Resolves one comparison entry (address or LOC ID) to its details."""
+    row = {
+        "input": entry,
+        "selectedAddress": None,
+        "locID": None,
+        "details": None,
+        "error": None,
+    }
+    try:
+        if entry.upper().startswith("LOC"):
+            loc_id = entry.upper()
+        else:
+            address_raw_json = await fetch_autocomplete(entry)
+            valid_suggestions = [
+                s
+                for s in address_raw_json.get("suggestions", [])
+                if s.get("id", "").startswith("LOC")
+            ]
+            if not valid_suggestions:
+                row["error"] = "No valid matches for this address"
+                return row
+            # There's no room to choose between suggestions in a table, so take
+            # the best match as the batch lookups do
+            loc_id = valid_suggestions[0]["id"]
+            row["selectedAddress"] = valid_suggestions[0].get("formattedAddress")
+        row["locID"] = loc_id
+
+        details_raw_json, details_fetched = await fetch_details(loc_id)
+        loc_details_result = parse_details(details_raw_json)
+        if loc_details_result is None:
+            row["error"] = "Could not retrieve detailed location information"
+            return row
+        if details_fetched:
+            record_details(loc_id, loc_details_result)
+        if row["selectedAddress"] is None and loc_details_result["exactMatch"]:
+            row["selectedAddress"] = details_raw_json["addressDetail"].get(
+                "formattedAddress"
+            )
+        row["details"] = loc_details_result
+    except Exception as e:
+        logger.exception(
+            "Comparison lookup failed",
+            extra={"event": "lookup_error", "input": entry},
+        )
+        row["error"] = f"Lookup failed: {e}"
+    return row
+
+
+@app.get("/compare", response_class=HTMLResponse)
+async def compare_form(request: Request):
+    """Renders the multi-premises comparison form."""
+    return templates.TemplateResponse(request, "compare.html", {"request": request})
+
+
+@app.post("/compare", response_class=HTMLResponse)
+async def compare_premises(request: Request, addresses: str = Form(...)):
+    """Looks up several addresses or LOC IDs at once and renders one table."""
+    max_entries = int(os.environ.get("NBNCHECKER_COMPARE_MAX", "10"))
+    # One per line; repeats are only looked up once
+    entries = list(
+        dict.fromkeys(line.strip() for line in addresses.splitlines() if line.strip())
+    )
+    context = {"request": request, "addresses_input": addresses}
+    if not entries:
+        context["error_message"] = "Enter at least one address or LOC ID."
+    elif len(entries) > max_entries:
+        context["error_message"] = f"Up to {max_entries} addresses can be compared at once."
+    else:
+        logger.info("Comparison", extra={"event": "compare", "count": len(entries)})
+        # All lookups run at once over the shared pool, so the page takes
+        # about as long as the slowest one
+        context["rows"] = await asyncio.gather(
+            *(compare_one(entry) for entry in entries)
+        )
+    return templates.TemplateResponse(request, "compare.html", context)
+
+
+@app.get("/api/crawl")
+async def crawl_premises(address: str, street: bool = False):
+    """Streams every LOC ID found in the seed's building (or street) as NDJSON."""
+    # Imported here as crawls are rare; it keeps the CLI plumbing out of startup
+    from crawler import Crawler, Seed
+
+    # Refuse a bad seed now; once streaming starts the status is already sent
+    try:
+        Seed.parse(address)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    crawler = Crawler(
+        concurrency=int(os.environ.get("NBNCHECKER_CRAWL_CONCURRENCY", "5")),
+        rate=float(os.environ.get("NBNCHECKER_CRAWL_RATE", "5")),
+        on_fetched=record_details,
+    )
+
+    async def stream():
+        async for record in crawler.crawl(address, street=street):
+            yield json.dumps(record) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 if __name__ == "__main__":
-    # Run the FastAPI app using uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    # Only needed when run as a script. Passing the app object rather than
+    # "main:app" avoids importing this module a second time
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""Compiles the app's modules and templates ahead of time.
+
+Run while building the image, so a fresh container loads bytecode from
+disk instead of compiling on its first import and first render.
+"""
+import compileall
+from pathlib import Path
+
+APP_DIR = Path(__file__).parent
+
+
+def precompile() -> list[str]:
+    """Writes .pyc files for the app modules and fills the template cache."""
+    # Top level only; dependencies in .venv are compiled by uv
+    compileall.compile_dir(APP_DIR, maxlevels=0, quiet=1)
+
+    from main import templates
+
+    names = templates.env.list_templates()
+    for name in names:
+        templates.env.get_template(name)
+    return names
+
+
+if __name__ == "__main__":
+    print(f"Precompiled templates: {', '.join(precompile())}")
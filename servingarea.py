@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+
+
+class ServingAreaCache:
+    """Caches serving-area (CSA) details and links the LOC IDs seen in each.
+
+    When the details API can't place a premises exactly it returns only the
+    serving area, which is the same for every such premises in that CSA. Once
+    a LOC ID is known to resolve to a CSA that way, repeat lookups are served
+    from the CSA entry until it expires. Every observed LOC ID, exact or not,
+    also feeds the per-CSA techType/serviceStatus counts.
+    """
+
+    def __init__(self, ttl: float = 21600, max_premises: int = 100000):
+        self.ttl = ttl
+        self.max_premises = max_premises
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # csaId -> (expires_at, raw servingArea dict)
+        self._areas: dict[str, tuple[float, dict]] = {}
+        # locID -> (csaId, exactMatch, techType, serviceStatus), oldest first
+        self._premises: OrderedDict[str, tuple] = OrderedDict()
+        # csaId -> set of linked locIDs
+        self._members: dict[str, set[str]] = {}
+
+    def lookup(self, loc_id: str) -> Optional[dict]:
+        """Returns a details response for a non-exact LOC ID from its cached CSA."""
+        with self._lock:
+            linked = self._premises.get(loc_id)
+            area = None
+            if linked is not None and not linked[1]:
+                cached = self._areas.get(linked[0])
+                if cached is not None and cached[0] > time.monotonic():
+                    area = cached[1]
+            if area is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._premises.move_to_end(loc_id)
+        # Shaped like the API's own answer for a premises it can't place exactly
+        return {"addressDetail": {}, "servingArea": dict(area)}
+
+    def observe(self, loc_id: str, details: dict) -> None:
+        """Records a raw details API response for a LOC ID."""
+        area = details.get("servingArea") or {}
+        csa_id = area.get("csaId")
+        if not csa_id:
+            return
+        address = details.get("addressDetail") or {}
+        exact = "id" in address
+        source = address if exact else area
+        entry = (
+            csa_id,
+            exact,
+            source.get("techType"),
+            source.get("serviceStatus"),
+        )
+
+        with self._lock:
+            self._areas[csa_id] = (time.monotonic() + self.ttl, area)
+            previous = self._premises.pop(loc_id, None)
+            if previous is not None and previous[0] != csa_id:
+                self._unlink(loc_id, previous[0])
+            self._premises[loc_id] = entry
+            self._members.setdefault(csa_id, set()).add(loc_id)
+            while len(self._premises) > self.max_premises:
+                evicted, (evicted_csa, *_) = self._premises.popitem(last=False)
+                self._unlink(evicted, evicted_csa)
+
+    def _unlink(self, loc_id: str, csa_id: str) -> None:
+        members = self._members.get(csa_id)
+        if members is not None:
+            members.discard(loc_id)
+            if not members:
+                # Nothing references this CSA any more
+                del self._members[csa_id]
+                self._areas.pop(csa_id, None)
+
+    def aggregate(self, csa_id: str) -> Optional[dict]:
+        """Counts techType/serviceStatus across the LOC IDs seen in a CSA."""
+        with self._lock:
+            members = self._members.get(csa_id)
+            if not members:
+                return None
+            entries = [self._premises[loc_id] for loc_id in members]
+            expires_at, area = self._areas.get(csa_id, (0, None))
+        return {
+            "csaId": csa_id,
+            "servingArea": area,
+            "fresh": expires_at > time.monotonic(),
+            "premises": len(entries),
+            "exactMatches": sum(1 for entry in entries if entry[1]),
+            "techType": dict(Counter(entry[2] for entry in entries)),
+            "serviceStatus": dict(Counter(entry[3] for entry in entries)),
+        }
+
+    def summary(self) -> list[dict]:
+        """Returns premises counts for every CSA seen, largest first."""
+        with self._lock:
+            counts = [
+                {"csaId": csa_id, "premises": len(members)}
+                for csa_id, members in self._members.items()
+            ]
+        return sorted(counts, key=lambda entry: entry["premises"], reverse=True)
+
+    def stats(self) -> dict:
+        return {
+            "areas": len(self._areas),
+            "premises": len(self._premises),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Shared by every lookup path, so this module is kept free of web framework
+# imports as api.py uses it
+serving_areas = ServingAreaCache(
+    ttl=float(os.environ.get("NBNCHECKER_CSA_TTL", "21600")),
+    max_premises=int(os.environ.get("NBNCHECKER_CSA_MAX_PREMISES", "100000")),
+)
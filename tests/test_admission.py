@@ -0,0 +1,111 @@
+import unittest
+import asyncio
+import sys
+import os
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'admission'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from admission import AdmissionController, AdmissionControlMiddleware
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_admits_up_to_limit_then_sheds(self):
+        """Test requests beyond the limit and queue are shed immediately."""
+        async def run():
+            controller = AdmissionController(limit=2, queue_size=0)
+            admitted = [await controller.acquire() for _ in range(3)]
+            return admitted, controller.stats()
+
+        admitted, stats = asyncio.run(run())
+        self.assertEqual(admitted, [True, True, False])
+        self.assertEqual(stats["active"], 2)
+        self.assertEqual(stats["shed"], 1)
+
+    def test_queued_request_gets_released_slot(self):
+        """Test a queued request is admitted when a running one finishes."""
+        async def run():
+            controller = AdmissionController(limit=1, queue_size=1, queue_timeout=1)
+            self.assertTrue(await controller.acquire())
+            waiter = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(controller.waiting, 1)
+            controller.release()
+            admitted = await waiter
+            return admitted, controller.stats()
+
+        admitted, stats = asyncio.run(run())
+        self.assertTrue(admitted)
+        self.assertEqual(stats["active"], 1)
+        self.assertEqual(stats["waiting"], 0)
+
+    def test_queued_request_times_out(self):
+        """Test a queued request is shed once its wait exceeds the timeout."""
+        async def run():
+            controller = AdmissionController(limit=1, queue_size=1, queue_timeout=0.01)
+            await controller.acquire()
+            admitted = await controller.acquire()
+            controller.release()
+            return admitted, controller.stats()
+
+        admitted, stats = asyncio.run(run())
+        self.assertFalse(admitted)
+        self.assertEqual(stats["active"], 0)
+        self.assertEqual(stats["shed"], 1)
+
+
+class TestAdmissionControlMiddleware(unittest.TestCase):
+    def _app(self, controller):
+        app = FastAPI()
+
+        @app.post("/")
+        async def lookup():
+            return {"ok": True}
+
+        @app.get("/health")
+        async def health():
+            return {"status": "healthy"}
+
+        app.add_middleware(
+            AdmissionControlMiddleware,
+            controller=controller,
+            routes=[("POST", "/")],
+            retry_after=5,
+        )
+        return app
+
+    def test_sheds_lookup_route_with_retry_after(self):
+        """Test a full lookup route returns 503 with a Retry-After header."""
+        controller = AdmissionController(limit=1, queue_size=0)
+        controller.active = 1  # Simulate a lookup already in progress
+        with TestClient(self._app(controller)) as client:
+            response = client.post("/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "5")
+
+    def test_other_routes_unaffected(self):
+        """Test routes outside the admission set bypass the limit."""
+        controller = AdmissionController(limit=1, queue_size=0)
+        controller.active = 1
+        with TestClient(self._app(controller)) as client:
+            response = client.get("/health")
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_slot_released_after_request(self):
+        """Test the slot is returned once the lookup completes."""
+        controller = AdmissionController(limit=1, queue_size=0)
+        with TestClient(self._app(controller)) as client:
+            first = client.post("/")
+            second = client.post("/")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(controller.active, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
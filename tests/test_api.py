@@ -2,11 +2,22 @@ import unittest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import asyncio
+import httpx
 
 # Add the parent directory to the Python path to allow importing 'api'
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from api import nbnQueryAddress, nbnLocDetails
+from api import (
+    nbnQueryAddress,
+    nbnLocDetails,
+    nbnQueryAddressAsync,
+    nbnAutocompleteAsync,
+    nbnLocDetailsAsync,
+    nbnQueryAddressBatch,
+    nbnLocDetailsBatch,
+)
+from servingarea import ServingAreaCache
 
 class TestNbnApiFunctions(unittest.TestCase):
 
@@ -193,5 +204,169 @@ class TestNbnApiFunctions(unittest.TestCase):
         self.assertNotIn("patChangeDate", result)
 
 
+class TestNbnApiAsyncFunctions(unittest.TestCase):
+
+    def _client(self, handler):
+        """Builds an AsyncClient that routes requests to a local handler."""
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_nbnQueryAddressAsync_success(self):
+        """Test nbnQueryAddressAsync parses the first suggestion."""
+        def handler(request):
+            self.assertEqual(request.url.params["query"], "1 Test St")
+            return httpx.Response(200, json={
+                "suggestions": [
+                    {"id": "LOC000123456789", "formattedAddress": "1 Test St, SYDNEY NSW 2000"}
+                ]
+            })
+
+        async def run():
+            async with self._client(handler) as client:
+                return await nbnQueryAddressAsync("1 Test St", client=client)
+
+        result = asyncio.run(run())
+        self.assertTrue(result["validResult"])
+        self.assertEqual(result["locID"], "LOC000123456789")
+
+    def test_nbnAutocompleteAsync_encodes_query(self):
+        """Test characters with meaning in URLs reach the API intact."""
+        query = "Unit 3 #2 Smith & Sons Rd+"
+
+        def handler(request):
+            self.assertEqual(request.url.params["query"], query)
+            return httpx.Response(200, json={"suggestions": []})
+
+        async def run():
+            async with self._client(handler) as client:
+                return await nbnAutocompleteAsync(query, client=client)
+
+        self.assertEqual(asyncio.run(run()), [])
+
+    def test_nbnLocDetailsAsync_http_error(self):
+        """Test nbnLocDetailsAsync raises on a non-2xx response."""
+        def handler(request):
+            return httpx.Response(404, json={})
+
+        async def run():
+            async with self._client(handler) as client:
+                return await nbnLocDetailsAsync("LOC000000000000", client=client)
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            asyncio.run(run())
+
+    def test_nbnLocDetailsAsync_uses_serving_area_cache(self):
+        """Test a premises known only by its CSA isn't fetched twice."""
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            return httpx.Response(200, json={
+                "addressDetail": {},
+                "servingArea": {"csaId": "CSA100", "techType": "FTTN"},
+            })
+
+        async def run():
+            async with self._client(handler) as client:
+                first = await nbnLocDetailsAsync("LOC000000000001", client=client)
+                second = await nbnLocDetailsAsync("LOC000000000001", client=client)
+                return first, second
+
+        with patch("servingarea.serving_areas", ServingAreaCache()):
+            first, second = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+
+    def test_nbnLocDetailsBatch_bounded_concurrency(self):
+        """Test nbnLocDetailsBatch never exceeds the concurrency limit."""
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            loc_id = request.url.path.rsplit("/", 1)[-1]
+            return httpx.Response(200, json={
+                "addressDetail": {
+                    "id": loc_id,
+                    "techType": "FTTP",
+                    "serviceStatus": "available",
+                    "coatChangeReason": "",
+                }
+            })
+
+        loc_ids = [f"LOC{i:012d}" for i in range(20)]
+
+        async def run():
+            async with self._client(handler) as client:
+                return [
+                    item async for item in nbnLocDetailsBatch(
+                        loc_ids, concurrency=3, client=client
+                    )
+                ]
+
+        results = asyncio.run(run())
+        self.assertEqual(peak, 3)
+        self.assertEqual(sorted(loc for loc, _ in results), loc_ids)
+        for loc_id, details in results:
+            self.assertEqual(details["locID"], loc_id)
+
+    def test_batch_beyond_pool_size_gets_own_client(self):
+        """Test batches wider than the shared pool use a client sized to match."""
+        def handler(request):
+            return httpx.Response(200, json={"suggestions": []})
+
+        client = self._client(handler)
+
+        async def run():
+            return [
+                item async for item in nbnQueryAddressBatch(["a", "b"], concurrency=5)
+            ]
+
+        with patch("upstream.MAX_CONNECTIONS", 2), patch(
+            "upstream.create_async_client", return_value=client
+        ) as create:
+            results = asyncio.run(run())
+
+        create.assert_called_once_with(5)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(client.is_closed)
+
+    def test_nbnQueryAddressBatch_return_exceptions(self):
+        """Test nbnQueryAddressBatch yields failures when returnExceptions is set."""
+        def handler(request):
+            if request.url.params["query"] == "bad":
+                return httpx.Response(500)
+            return httpx.Response(200, json={"suggestions": []})
+
+        async def run():
+            async with self._client(handler) as client:
+                return dict([
+                    item async for item in nbnQueryAddressBatch(
+                        ["good", "bad"], returnExceptions=True, client=client
+                    )
+                ])
+
+        results = asyncio.run(run())
+        self.assertFalse(results["good"]["validResult"])
+        self.assertIsInstance(results["bad"], httpx.HTTPStatusError)
+
+    def test_nbnQueryAddressBatch_raises_by_default(self):
+        """Test nbnQueryAddressBatch propagates the first failure by default."""
+        def handler(request):
+            return httpx.Response(500)
+
+        async def run():
+            async with self._client(handler) as client:
+                return [
+                    item async for item in nbnQueryAddressBatch(["bad"], client=client)
+                ]
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            asyncio.run(run())
+
+
 if __name__ == '__main__':
     unittest.main()
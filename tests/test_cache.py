@@ -0,0 +1,456 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cache
+from cache import CacheError, MemoryCache, RedisCache, TieredCache
+from api import nbnLocDetailsAsync, nbnLocDetailsBatch
+
+REDIS_URL = os.environ.get("NBNCHECKER_TEST_REDIS_URL")
+
+
+class FakeRedis:
+    """A Redis-protocol server speaking just what RedisCache uses."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def url(self, credentials="", db=""):
+        return f"redis://{credentials}127.0.0.1:{self.port}/{db}"
+
+    async def _serve(self, reader, writer):
+        authed = self.password is None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                name = args[0].upper().decode()
+                self.commands.append((name, *args[1:]))
+                if name == "AUTH":
+                    authed = args[-1].decode() == self.password
+                    writer.write(b"+OK\r\n" if authed else b"-WRONGPASS invalid password\r\n")
+                elif not authed:
+                    writer.write(b"-NOAUTH Authentication required.\r\n")
+                elif name == "SELECT":
+                    writer.write(b"+OK\r\n")
+                elif name == "SET":
+                    expires = time.monotonic() + int(args[4]) if len(args) > 4 else None
+                    self.data[args[1]] = (args[2], expires)
+                    writer.write(b"+OK\r\n")
+                elif name in ("GET", "MGET"):
+                    values = [self._get(key) for key in args[1:]]
+                    if name == "MGET":
+                        writer.write(b"*%d\r\n" % len(values))
+                    for value in values:
+                        if value is None:
+                            writer.write(b"$-1\r\n")
+                        else:
+                            writer.write(b"$%d\r\n%s\r\n" % (len(value), value))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            return None
+        return value
+
+
+def with_redis(test, **kwargs):
+    """Runs test(fake) on an event loop with a FakeRedis listening."""
+    async def run():
+        fake = await FakeRedis(**kwargs).start()
+        try:
+            return await test(fake)
+        finally:
+            await fake.stop()
+
+    return asyncio.run(run())
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_entries_expire(self):
+        """Test entries are gone once their TTL passes."""
+        memory = MemoryCache()
+        with patch("cache.time.monotonic", return_value=100):
+            asyncio.run(memory.set("k", {"a": 1}, 10))
+            self.assertEqual(asyncio.run(memory.get("k")), {"a": 1})
+        with patch("cache.time.monotonic", return_value=110):
+            self.assertIsNone(asyncio.run(memory.get("k")))
+        self.assertEqual(memory.stats(), {"entries": 0, "hits": 1, "misses": 1})
+
+    def test_least_recently_used_evicted(self):
+        """Test the least recently read entry is dropped when full."""
+        memory = MemoryCache(max_entries=2)
+
+        async def run():
+            await memory.set("a", 1, 60)
+            await memory.set("b", 2, 60)
+            await memory.get("a")
+            await memory.set("c", 3, 60)
+            return await memory.get_many(["a", "b", "c"])
+
+        self.assertEqual(asyncio.run(run()), [1, None, 3])
+
+    def test_values_are_copies(self):
+        """Test mutating a returned value doesn't change the cached one."""
+        memory = MemoryCache()
+
+        async def run():
+            await memory.set("k", {"a": [1]}, 60)
+            (await memory.get("k"))["a"].append(2)
+            return await memory.get("k")
+
+        self.assertEqual(asyncio.run(run()), {"a": [1]})
+
+
+class TestRedisCache(unittest.TestCase):
+    def test_set_and_get_many(self):
+        """Test values round trip and a multi-get is one MGET."""
+        async def test(fake):
+            redis = RedisCache(fake.url())
+            await redis.set("details:LOC1", {"id": "LOC1"}, 60)
+            values = await redis.get_many(["details:LOC1", "details:LOC2"])
+            await redis.close()
+            return fake, values
+
+        fake, values = with_redis(test)
+        self.assertEqual(values, [{"id": "LOC1"}, None])
+        self.assertEqual(
+            fake.commands,
+            [
+                ("SET", b"nbnchecker:details:LOC1", b'{"id":"LOC1"}', b"EX", b"60"),
+                ("MGET", b"nbnchecker:details:LOC1", b"nbnchecker:details:LOC2"),
+            ],
+        )
+
+    def test_set_many_pipelined_on_one_connection(self):
+        """Test several writes share one connection and all carry a TTL."""
+        async def test(fake):
+            redis = RedisCache(fake.url())
+            connects = 0
+            connect = redis._connect
+
+            async def counting_connect():
+                nonlocal connects
+                connects += 1
+                return await connect()
+
+            redis._connect = counting_connect
+            await redis.set_many([(f"k{i}", i) for i in range(50)], 30)
+            await redis.get_many(["k0", "k49"])
+            await redis.close()
+            return fake, connects
+
+        fake, connects = with_redis(test)
+        self.assertEqual(connects, 1)
+        sets = [c for c in fake.commands if c[0] == "SET"]
+        self.assertEqual(len(sets), 50)
+        self.assertTrue(all(c[3:] == (b"EX", b"30") for c in sets))
+
+    def test_auth_and_database_from_url(self):
+        """Test credentials and the database number in the URL are sent first."""
+        async def test(fake):
+            redis = RedisCache(fake.url("user:s%40cret@", "2"))
+            await redis.get("k")
+            await redis.close()
+            return fake
+
+        fake = with_redis(test, password="s@cret")
+        self.assertEqual(
+            fake.commands[:2],
+            [("AUTH", b"user", b"s@cret"), ("SELECT", b"2")],
+        )
+
+    def test_error_reply_raises(self):
+        """Test an error reply from the server surfaces as a CacheError."""
+        async def test(fake):
+            redis = RedisCache(fake.url())
+            try:
+                await redis.get("k")
+            finally:
+                await redis.close()
+
+        with self.assertRaisesRegex(CacheError, "NOAUTH"):
+            with_redis(test, password="secret")
+
+    def test_unreachable_server_raises(self):
+        """Test a server that isn't listening surfaces as a CacheError."""
+        async def test(fake):
+            url = fake.url()
+            await fake.stop()
+            await RedisCache(url).get("k")
+
+        async def run():
+            fake = await FakeRedis().start()
+            await test(fake)
+
+        with self.assertRaises(CacheError):
+            asyncio.run(run())
+
+
+class TestTieredCache(unittest.TestCase):
+    def test_shared_hits_fill_local(self):
+        """Test values from the shared cache are kept locally afterwards."""
+        async def test(fake):
+            shared = RedisCache(fake.url())
+            await shared.set("k", "v", 60)
+            tiered = TieredCache(MemoryCache(max_ttl=30), shared)
+            first = await tiered.get("k")
+            second = await tiered.get("k")
+            await tiered.close()
+            return fake, first, second
+
+        fake, first, second = with_redis(test)
+        self.assertEqual((first, second), ("v", "v"))
+        self.assertEqual([c[0] for c in fake.commands], ["SET", "MGET"])
+
+    def test_prefetch_is_one_round_trip(self):
+        """Test a prefetch reads the shared cache once for all its keys."""
+        async def test(fake):
+            shared = RedisCache(fake.url())
+            await shared.set("a", 1, 60)
+            tiered = TieredCache(MemoryCache(max_ttl=30), shared)
+            await tiered.prefetch(["a", "b", "c"])
+            values = [await tiered.get(key) for key in ("a", "b", "c")]
+            await tiered.close()
+            return fake, values
+
+        fake, values = with_redis(test)
+        self.assertEqual(values, [1, None, None])
+        self.assertEqual(
+            [c[0] for c in fake.commands], ["SET", "MGET"]
+        )
+
+    def test_shared_failure_falls_back_to_local(self):
+        """Test an unavailable shared cache counts as a miss and is then skipped."""
+        class Broken(cache.CacheBackend):
+            calls = 0
+
+            async def get_many(self, keys):
+                Broken.calls += 1
+                raise CacheError("down")
+
+            async def set(self, key, value, ttl):
+                Broken.calls += 1
+                raise CacheError("down")
+
+        tiered = TieredCache(MemoryCache(), Broken(), retry_after=60)
+
+        async def run():
+            missed = await tiered.get("k")
+            await tiered.set("k", "v", 60)
+            return missed, await tiered.get("k")
+
+        with self.assertLogs("nbnchecker.cache", "WARNING"):
+            self.assertEqual(asyncio.run(run()), (None, "v"))
+        self.assertEqual(Broken.calls, 1)
+        self.assertEqual(tiered.stats()["shared"]["errors"], 1)
+
+
+    def test_stats_count_shared_hits_and_misses(self):
+        """Test shared reads are counted separately from local ones."""
+        async def test(fake):
+            shared = RedisCache(fake.url())
+            await shared.set("a", 1, 60)
+            tiered = TieredCache(MemoryCache(max_ttl=30), shared)
+            for key in ("a", "a", "b"):
+                await tiered.get(key)
+            await tiered.close()
+            return fake, tiered.stats()
+
+        _, stats = with_redis(test)
+        self.assertEqual(stats["local"]["hits"], 1)
+        self.assertEqual(stats["shared"], {"hits": 1, "misses": 1, "errors": 0})
+
+    def test_backends_must_implement_reads_and_writes(self):
+        """Test a backend missing get_many or set can't be created."""
+        class ReadOnly(cache.CacheBackend):
+            async def get_many(self, keys):
+                return [None] * len(keys)
+
+        with self.assertRaises(TypeError):
+            ReadOnly()
+
+class TestConfiguredCache(unittest.TestCase):
+    def tearDown(self):
+        cache._cache = cache._cache_url = None
+
+    def _details_client(self, calls):
+        def handler(request):
+            calls.append(request.url.path)
+            return httpx.Response(200, json={
+                "addressDetail": {
+                    "id": request.url.path.rsplit("/", 1)[-1],
+                    "techType": "FTTP",
+                    "serviceStatus": "available",
+                    "coatChangeReason": "",
+                }
+            })
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_unset_means_no_cache(self):
+        """Test no cache is used unless NBNCHECKER_CACHE_URL is set."""
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("NBNCHECKER_CACHE_URL", None)
+            self.assertIsNone(cache.get_cache())
+
+    def test_lookups_reuse_cached_responses(self):
+        """Test a repeated details lookup is answered from the cache."""
+        calls = []
+
+        async def run():
+            async with self._details_client(calls) as client:
+                first = await nbnLocDetailsAsync("LOC000000000001", client)
+                second = await nbnLocDetailsAsync("LOC000000000001", client)
+            return first, second
+
+        with patch.dict(os.environ, {"NBNCHECKER_CACHE_URL": "memory"}):
+            first, second = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+
+    def test_only_fetched_details_are_archived(self):
+        """Test job and crawl lookups answered from the cache aren't archived again."""
+        import jobs
+        from crawler import Crawler
+
+        calls = []
+        archived = []
+
+        async def run():
+            async with self._details_client(calls) as client:
+                with patch("api.getAsyncClient", return_value=client):
+                    await jobs.lookup("LOC000000000001")
+                    await jobs.lookup("LOC000000000001")
+                crawler = Crawler(
+                    client=client, rate=1000,
+                    on_fetched=lambda loc_id, _: archived.append(loc_id),
+                )
+                with patch("crawler.nbnAutocompleteAsync", return_value=[
+                    {"id": "LOC000000000001", "formattedAddress": "1 SMITH ST"},
+                    {"id": "LOC000000000002", "formattedAddress": "2 SMITH ST"},
+                ]):
+                    return [r async for r in crawler.crawl("Smith St")]
+
+        with patch.dict(os.environ, {"NBNCHECKER_CACHE_URL": "memory"}), patch(
+            "jobs.record_details"
+        ) as record:
+            records = asyncio.run(run())
+        self.assertEqual(record.call_count, 1)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(archived, ["LOC000000000002"])
+        self.assertEqual(len(calls), 2)
+
+    def test_batch_prefetches_from_shared_cache(self):
+        """Test a batch reads the shared cache with one MGET per chunk."""
+        calls = []
+        loc_ids = [f"LOC{i:012d}" for i in range(10)]
+
+        async def test(fake):
+            with patch.dict(os.environ, {"NBNCHECKER_CACHE_URL": fake.url()}):
+                shared = RedisCache(fake.url())
+                await shared.set(
+                    f"details:{loc_ids[0]}",
+                    {"addressDetail": {"id": loc_ids[0], "techType": "HFC",
+                                       "serviceStatus": "available",
+                                       "coatChangeReason": ""}},
+                    60,
+                )
+                await shared.close()
+                async with self._details_client(calls) as client:
+                    results = dict([
+                        item async for item in nbnLocDetailsBatch(
+                            loc_ids, concurrency=3, client=client
+                        )
+                    ])
+                await cache.close_cache()
+            return fake, results
+
+        fake, results = with_redis(test)
+        self.assertEqual(results[loc_ids[0]]["techType"], "HFC")
+        self.assertEqual(len(calls), 9)
+        self.assertEqual([c[0] for c in fake.commands].count("MGET"), 1)
+
+
+    def test_job_chunk_prefetches_from_shared_cache(self):
+        """Test a job chunk reads the shared cache in two MGETs, not one per lookup."""
+        import jobs
+
+        calls = []
+        cached = {"addressDetail": {"id": "LOC000000000001", "techType": "HFC",
+                                    "serviceStatus": "available",
+                                    "coatChangeReason": ""}}
+
+        async def test(fake):
+            with patch.dict(os.environ, {"NBNCHECKER_CACHE_URL": fake.url()}):
+                shared = RedisCache(fake.url())
+                await shared.set("autocomplete:1 smith st", {"suggestions": [
+                    {"id": "LOC000000000001", "formattedAddress": "1 SMITH ST"},
+                ]}, 60)
+                await shared.set("details:LOC000000000001", cached, 60)
+                await shared.close()
+                async with self._details_client(calls) as client:
+                    with patch("api.getAsyncClient", return_value=client), patch(
+                        "jobs.record_details"
+                    ):
+                        worker = jobs.JobWorker(None, "test")
+                        results = await worker.process_chunk(
+                            [(0, "1 Smith St"), (1, "LOC000000000002")]
+                        )
+                await cache.close_cache()
+            return fake, results
+
+        fake, results = with_redis(test)
+        self.assertEqual(results[0][1]["details"]["techType"], "HFC")
+        self.assertEqual(results[1][1]["details"]["techType"], "FTTP")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([c[0] for c in fake.commands].count("MGET"), 2)
+
+@unittest.skipUnless(REDIS_URL, "NBNCHECKER_TEST_REDIS_URL is not set")
+class TestRealRedis(unittest.TestCase):
+    def test_round_trip(self):
+        """Test set, get and multi-get against a real Redis-protocol server."""
+        async def run():
+            redis = RedisCache(REDIS_URL, prefix="nbnchecker-test:")
+            try:
+                await redis.set_many([("a", {"x": 1}), ("b", [2])], 60)
+                return await redis.get_many(["a", "b", "missing"])
+            finally:
+                await redis.close()
+
+        self.assertEqual(asyncio.run(run()), [{"x": 1}, [2], None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import asyncio
+import gzip
+import sys
+import os
+import zlib
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'contentencoding'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from contentencoding import CompressionMiddleware, negotiate
+
+
+def make_app(minimum_size=100):
+    app = FastAPI()
+
+    @app.get("/big")
+    async def big():
+        return JSONResponse({"rows": ["x" * 10] * 100})
+
+    @app.get("/small")
+    async def small():
+        return JSONResponse({"ok": True})
+
+    @app.get("/encoded")
+    async def encoded():
+        body = gzip.compress(b"y" * 1000)
+        return PlainTextResponse(body, headers={"Content-Encoding": "gzip"})
+
+    @app.get("/binary")
+    async def binary():
+        return PlainTextResponse(b"z" * 1000, media_type="application/octet-stream")
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for i in range(3):
+                yield f'{{"line": {i}}}\n'
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    app.add_middleware(CompressionMiddleware, minimum_size=minimum_size)
+    return app
+
+
+class TestNegotiate(unittest.TestCase):
+    def test_prefers_highest_quality(self):
+        """Test the client's q-values decide before server preference."""
+        self.assertEqual(negotiate("gzip;q=1, zstd;q=0.5", ["zstd", "gzip"]), "gzip")
+
+    def test_ties_use_server_order(self):
+        """Test equally rated encodings fall back to server preference."""
+        self.assertEqual(negotiate("gzip, br, zstd", ["zstd", "gzip"]), "zstd")
+
+    def test_refused_and_wildcard(self):
+        """Test q=0 refuses an encoding and * covers unlisted ones."""
+        self.assertIsNone(negotiate("gzip;q=0", ["gzip"]))
+        self.assertEqual(negotiate("*", ["gzip"]), "gzip")
+        self.assertIsNone(negotiate("identity", ["gzip"]))
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(make_app())
+
+    def get(self, path, encoding="gzip"):
+        # Ask for the raw bytes so the test sees exactly what was sent
+        with self.client.stream(
+            "GET", path, headers={"Accept-Encoding": encoding}
+        ) as response:
+            return response, b"".join(response.iter_raw())
+
+    def test_compresses_large_json(self):
+        """Test large JSON responses are gzipped with Vary set."""
+        response, body = self.get("/big")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["vary"])
+        self.assertEqual(int(response.headers["content-length"]), len(body))
+        self.assertIn(b'"rows"', gzip.decompress(body))
+
+    def test_small_responses_uncompressed(self):
+        """Test responses below the threshold are sent as-is."""
+        response, body = self.get("/small")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(body, b'{"ok":true}')
+
+    def test_skips_already_encoded_and_binary(self):
+        """Test encoded and non-text responses are passed through."""
+        response, body = self.get("/encoded")
+        self.assertEqual(gzip.decompress(body), b"y" * 1000)
+        response, body = self.get("/binary")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(body, b"z" * 1000)
+
+    def test_no_accept_encoding(self):
+        """Test clients that don't accept compression get plain output."""
+        response, body = self.get("/big", encoding="identity")
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_streamed_chunks_flushed(self):
+        """Test each streamed chunk decodes on its own as it is sent."""
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if requested:
+                # Stay connected until the response finishes
+                await asyncio.Event().wait()
+            requested = True
+            return {"type": "http.request", "body": b""}
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/stream",
+            "raw_path": b"/stream",
+            "root_path": "",
+            "scheme": "http",
+            "query_string": b"",
+            "headers": [(b"accept-encoding", b"gzip")],
+            "server": ("testserver", 80),
+            "client": ("testclient", 50000),
+            "http_version": "1.1",
+        }
+        asyncio.run(make_app()(scope, receive, send))
+
+        start, *bodies = messages
+        headers = dict(start["headers"])
+        self.assertEqual(headers[b"content-encoding"], b"gzip")
+        self.assertNotIn(b"content-length", headers)
+        decoder = zlib.decompressobj(31)
+        lines = [decoder.decompress(m["body"]) for m in bodies if m.get("more_body")]
+        self.assertEqual(lines, [b'{"line": %d}\n' % i for i in range(3)])
+        decoder.decompress(bodies[-1]["body"])
+        self.assertTrue(decoder.eof)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import asyncio
+import sys
+import os
+import httpx
+
+# Add the parent directory to the Python path to allow importing 'crawler'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from crawler import Crawler, RateLimiter, Seed
+
+
+def details_response(loc_id):
+    return httpx.Response(200, json={
+        "addressDetail": {
+            "id": loc_id,
+            "techType": "FTTP",
+            "serviceStatus": "available",
+            "coatChangeReason": "",
+        }
+    })
+
+
+class TestSeed(unittest.TestCase):
+    def test_parse_unit_address(self):
+        """Test a unit address is reduced to its building."""
+        seed = Seed.parse("3/12A Smith St, SUBURB NSW 2000")
+        self.assertEqual(seed.house, "12A")
+        self.assertEqual(seed.street, "Smith St, SUBURB NSW 2000")
+        self.assertEqual(seed.query("1"), "1/12A Smith St, SUBURB NSW 2000")
+
+    def test_parse_street_only(self):
+        """Test an address without a house number crawls the street."""
+        seed = Seed.parse("Smith St, SUBURB NSW 2000")
+        self.assertIsNone(seed.house)
+        self.assertEqual(seed.query("4"), "4 Smith St, SUBURB NSW 2000")
+
+    def test_matches_building(self):
+        """Test suggestions are limited to the seed's building."""
+        seed = Seed.parse("12 Smith St")
+        self.assertTrue(seed.matches("UNIT 3 12 SMITH ST SUBURB"))
+        self.assertTrue(seed.matches("3/12 SMITH ST SUBURB"))
+        self.assertFalse(seed.matches("112 SMITH ST SUBURB"))
+        self.assertFalse(seed.matches("12 JONES ST SUBURB"))
+
+    def test_matches_whole_street_name(self):
+        """Test streets sharing a prefix or a word don't match."""
+        seed = Seed.parse("12 Smith St")
+        self.assertFalse(seed.matches("12 SMITHFIELD RD SUBURB"))
+        self.assertFalse(seed.matches("12 BLACKSMITH LANE SUBURB"))
+        self.assertFalse(seed.matches("12 SMITH RD SUBURB"))
+        avenue = Seed.parse("The Avenue")
+        self.assertTrue(avenue.matches("4 THE AVENUE SUBURB"))
+        self.assertFalse(avenue.matches("4 THE STRAND SUBURB"))
+
+    def test_matches_suburb_and_postcode(self):
+        """Test a seed with a locality only matches that locality."""
+        seed = Seed.parse("12 Smith Street, SUBURB NSW 2000")
+        self.assertTrue(seed.matches("3/12 SMITH ST, SUBURB NSW 2000"))
+        self.assertFalse(seed.matches("3/12 SMITH ST, OTHERTOWN NSW 2000"))
+        self.assertFalse(seed.matches("3/12 SMITH ST, SUBURB NSW 2001"))
+
+    def test_empty_seed_rejected(self):
+        """Test a blank seed is refused up front."""
+        for address in ("", "   ", " , "):
+            with self.assertRaisesRegex(ValueError, "empty"):
+                Seed.parse(address)
+
+
+class TestCrawler(unittest.TestCase):
+    def _crawl(self, handler, address, **kwargs):
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                crawler = Crawler(client=client, rate=1000, **kwargs)
+                return [record async for record in crawler.crawl(address)]
+
+        return asyncio.run(run())
+
+    def test_expands_saturated_queries_and_deduplicates(self):
+        """Test saturated queries are refined and each LOC ID is fetched once."""
+        queries = []
+        detail_calls = []
+
+        def handler(request):
+            if "autocomplete" in request.url.path:
+                query = request.url.params["query"]
+                queries.append(query)
+                if query == "12 Smith St":
+                    # Saturated response: forces unit prefix expansion
+                    units = range(1, 4)
+                elif query.startswith("1/"):
+                    units = [1, 10, 11]
+                else:
+                    units = []
+                return httpx.Response(200, json={"suggestions": [
+                    {"id": f"LOC{unit:012d}", "formattedAddress": f"{unit}/12 SMITH ST SUBURB"}
+                    for unit in units
+                ] + [{"id": "LOC999999999999", "formattedAddress": "14 SMITH ST SUBURB"}]})
+            loc_id = request.url.path.rsplit("/", 1)[-1]
+            detail_calls.append(loc_id)
+            return details_response(loc_id)
+
+        records = self._crawl(handler, "12 Smith St", saturation=4, max_prefix_length=1)
+
+        self.assertIn("1/12 Smith St", queries)
+        self.assertIn("9/12 Smith St", queries)
+        self.assertNotIn("10/12 Smith St", queries)  # Capped by max_prefix_length
+        found = sorted(record["locID"] for record in records)
+        self.assertEqual(found, [f"LOC{unit:012d}" for unit in (1, 2, 3, 10, 11)])
+        self.assertEqual(sorted(detail_calls), found)
+        self.assertTrue(all(record["details"]["exactMatch"] for record in records))
+
+    def test_reports_errors_without_stopping(self):
+        """Test failed details lookups are streamed as error records."""
+        def handler(request):
+            if "autocomplete" in request.url.path:
+                return httpx.Response(200, json={"suggestions": [
+                    {"id": "LOC000000000001", "formattedAddress": "1 SMITH ST"},
+                    {"id": "LOC000000000002", "formattedAddress": "2 SMITH ST"},
+                ]})
+            if request.url.path.endswith("LOC000000000002"):
+                return httpx.Response(500)
+            return details_response("LOC000000000001")
+
+        records = self._crawl(handler, "Smith St")
+
+        by_loc = {record["locID"]: record for record in records}
+        self.assertIn("details", by_loc["LOC000000000001"])
+        self.assertIn("error", by_loc["LOC000000000002"])
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_limits_rate(self):
+        """Test calls beyond the burst are spaced out by the rate."""
+        async def run():
+            limiter = RateLimiter(rate=100, burst=1)
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for _ in range(4):
+                await limiter.wait()
+            return loop.time() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.025)
+
+
+if __name__ == "__main__":
+    unittest.main()
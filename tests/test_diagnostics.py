@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tracemalloc
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'diagnostics'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from diagnostics import ProfilingMiddleware, router
+
+ADMIN = {"X-Admin-Token": "secret"}
+
+
+def build_app():
+    app = FastAPI()
+    app.include_router(router)
+
+    @app.post("/")
+    async def lookup():
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, routes=[("POST", "/")])
+    return app
+
+
+@patch.dict(os.environ, {"NBNCHECKER_ADMIN_TOKEN": "secret"})
+class TestProfilingMiddleware(unittest.TestCase):
+    def test_profile_report_returned_for_admin(self):
+        """Test an admin request with ?profile returns a cProfile report."""
+        with TestClient(build_app()) as client:
+            response = client.post("/?profile=1", headers=ADMIN)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn("POST / -> 200", response.text)
+        self.assertIn("cumulative", response.text)
+
+    def test_profile_header_without_token_is_ignored(self):
+        """Test profiling is not triggered without the admin token."""
+        with TestClient(build_app()) as client:
+            response = client.post("/", headers={"X-Profile": "1"})
+
+        self.assertEqual(response.json(), {"ok": True})
+
+    def test_normal_request_unaffected(self):
+        """Test admin requests without the profile flag run normally."""
+        with TestClient(build_app()) as client:
+            response = client.post("/", headers=ADMIN)
+
+        self.assertEqual(response.json(), {"ok": True})
+
+
+@patch.dict(os.environ, {"NBNCHECKER_ADMIN_TOKEN": "secret"})
+class TestMemoryRoutes(unittest.TestCase):
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_requires_admin(self):
+        """Test memory routes are hidden without the admin token."""
+        with TestClient(build_app()) as client:
+            response = client.post("/admin/memory/start")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_snapshot_requires_tracing(self):
+        """Test a snapshot is refused until tracing has started."""
+        with TestClient(build_app()) as client:
+            response = client.get("/admin/memory/snapshot", headers=ADMIN)
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_snapshot_and_diff(self):
+        """Test successive snapshots report top allocations and a diff."""
+        with TestClient(build_app()) as client:
+            client.post("/admin/memory/start", headers=ADMIN)
+            first = client.get("/admin/memory/snapshot", headers=ADMIN).json()
+            second = client.get("/admin/memory/snapshot?limit=5", headers=ADMIN).json()
+            client.post("/admin/memory/stop", headers=ADMIN)
+
+        self.assertIsNone(first["diff"])
+        self.assertIsInstance(second["diff"], list)
+        self.assertLessEqual(len(second["top"]), 5)
+        self.assertGreater(second["traced"]["current"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
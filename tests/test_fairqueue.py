@@ -0,0 +1,148 @@
+import unittest
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fairqueue import (
+    BATCH,
+    INTERACTIVE,
+    Client,
+    ClientIdentityMiddleware,
+    FairScheduler,
+    client_var,
+)
+
+
+async def grant_order(scheduler, clients):
+    """Queues one call per entry behind a held slot; returns who ran in what order."""
+    holder = Client("holder")
+    await scheduler.acquire(holder)
+    order = []
+
+    async def call(client):
+        await scheduler.acquire(client)
+        order.append(client.name)
+        await asyncio.sleep(0)
+        scheduler.release(client)
+
+    tasks = []
+    for client in clients:
+        tasks.append(asyncio.create_task(call(client)))
+        # Queue in the listed order
+        await asyncio.sleep(0)
+    scheduler.release(holder)
+    await asyncio.gather(*tasks)
+    return order
+
+
+class TestFairScheduler(unittest.TestCase):
+    def test_clients_take_turns(self):
+        """Test a client with a deep backlog doesn't hold up one arriving later."""
+        bulk, light = Client("bulk"), Client("light")
+        order = asyncio.run(
+            grant_order(FairScheduler(limit=1), [bulk] * 6 + [light] * 2)
+        )
+        self.assertEqual(order[:4], ["bulk", "light", "bulk", "light"])
+        self.assertEqual(order.count("bulk"), 6)
+
+    def test_interactive_goes_first(self):
+        """Test interactive calls jump ahead of queued batch calls."""
+        batch = Client("integration", BATCH)
+        interactive = Client("browser", INTERACTIVE)
+        order = asyncio.run(
+            grant_order(FairScheduler(limit=1), [batch] * 4 + [interactive])
+        )
+        self.assertEqual(order[0], "browser")
+
+    def test_quota_throttles_metered_clients(self):
+        """Test metered clients are held to the rate and unmetered ones aren't."""
+        scheduler = FairScheduler(limit=10, rate=100, burst=1)
+
+        async def run(client):
+            for _ in range(4):
+                await scheduler.acquire(client)
+                scheduler.release(client)
+
+        asyncio.run(run(Client("metered")))
+        asyncio.run(run(Client("internal", metered=False)))
+        clients = scheduler.stats()["clients"]
+        self.assertGreaterEqual(clients["metered"]["throttled_seconds"], 0.025)
+        self.assertEqual(clients["internal"]["throttled_seconds"], 0)
+        self.assertEqual(clients["metered"]["calls"], 4)
+        self.assertEqual(clients["metered"]["in_flight"], 0)
+
+    def test_cancelled_waiters_release_nothing(self):
+        """Test calls cancelled while queued don't leak or steal slots."""
+        scheduler = FairScheduler(limit=1)
+        client = Client("c")
+
+        async def run():
+            await scheduler.acquire(client)
+            waiters = [asyncio.create_task(scheduler.acquire(client)) for _ in range(3)]
+            await asyncio.sleep(0)
+            for waiter in waiters[:2]:
+                waiter.cancel()
+            scheduler.release(client)
+            await waiters[2]
+            scheduler.release(client)
+            return await asyncio.gather(*waiters[:2], return_exceptions=True)
+
+        cancelled = asyncio.run(run())
+        self.assertTrue(all(isinstance(c, asyncio.CancelledError) for c in cancelled))
+        self.assertEqual((scheduler.active, scheduler.waiting), (0, 0))
+        self.assertEqual(scheduler.stats()["clients"]["c"]["calls"], 2)
+
+
+class TestClientIdentityMiddleware(unittest.TestCase):
+    def _identify(self, method="GET", path="/api/crawl", headers=(), client=("10.0.0.1", 1234), **kwargs):
+        seen = []
+
+        async def app(scope, receive, send):
+            seen.append(client_var.get())
+
+        middleware = ClientIdentityMiddleware(
+            app, interactive_routes=[("POST", "/")], **kwargs
+        )
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "headers": [(k.encode(), v.encode()) for k, v in headers],
+            "client": client,
+        }
+        asyncio.run(middleware(scope, None, None))
+        self.assertIsNone(client_var.get())
+        return seen[0]
+
+    def test_identifies_by_api_key_then_ip(self):
+        """Test issued API keys (hashed) take precedence over the peer address."""
+        by_key = self._identify(headers=[("x-api-key", "secret")], api_keys=["secret"])
+        self.assertTrue(by_key.name.startswith("key:"))
+        self.assertNotIn("secret", by_key.name)
+        self.assertEqual(self._identify().name, "ip:10.0.0.1")
+
+    def test_unknown_api_keys_fall_back_to_ip(self):
+        """Test made-up keys can't give a client a fresh identity."""
+        for api_keys in ((), ["secret"]):
+            client = self._identify(headers=[("x-api-key", "other")], api_keys=api_keys)
+            self.assertEqual(client.name, "ip:10.0.0.1")
+
+    def test_forwarded_header_only_when_configured(self):
+        """Test the proxy-appended address is used only when a header is configured."""
+        headers = [("x-forwarded-for", "1.1.1.1, 203.0.113.9")]
+        self.assertEqual(self._identify(headers=headers).name, "ip:10.0.0.1")
+        self.assertEqual(
+            self._identify(headers=headers, ip_header="X-Forwarded-For").name,
+            "ip:203.0.113.9",
+        )
+
+    def test_interactive_routes(self):
+        """Test the form route is interactive and other routes are batch."""
+        self.assertEqual(self._identify("POST", "/").priority, INTERACTIVE)
+        self.assertEqual(self._identify().priority, BATCH)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import tempfile
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'history'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import history
+from history import HistoryArchive, _to_epoch
+
+DAY = 86400
+START = _to_epoch("2026-01-01")
+
+
+def details(tech, status="serviceable", pat=""):
+    return {"exactMatch": True, "techType": tech, "serviceStatus": status,
+            "patChangeDate": pat}
+
+
+class TestToEpoch(unittest.TestCase):
+    def test_date_only_upper_bound_covers_whole_day(self):
+        """Test a bare date used as an upper bound includes that entire day."""
+        self.assertEqual(_to_epoch("2026-01-01", end_of_day=True), START + DAY - 1)
+        self.assertEqual(
+            _to_epoch("2026-01-01T12:00:00", end_of_day=True), START + DAY // 2
+        )
+
+
+class TestHistoryArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = HistoryArchive(os.path.join(self.tmp.name, "history.sqlite3"))
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmp.cleanup()
+
+    def _count(self, table):
+        return self.archive._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_only_changes_are_stored(self):
+        """Test repeated identical observations don't add rows."""
+        for day in range(5):
+            self.archive.record("LOC000000000001", details("FTTN"), START + day * DAY)
+        self.archive.record("LOC000000000001", details("FTTP"), START + 5 * DAY)
+        self.archive.flush()
+
+        self.assertEqual(self._count("observations"), 2)
+        result = self.archive.history("LOC000000000001")
+        self.assertEqual([entry["techType"] for entry in result["history"]],
+                         ["FTTN", "FTTP"])
+        self.assertEqual(result["history"][1]["changed"], ["techType"])
+        self.assertEqual(result["history"][1]["serviceStatus"], "serviceable")
+        self.assertEqual(result["lastSeen"], "2026-01-06T00:00:00+00:00")
+
+    def test_tech_changes_in_range(self):
+        """Test the change query filters by date and reports old and new values."""
+        self.archive.record("LOC000000000001", details("FTTN"), START)
+        self.archive.record("LOC000000000002", details("FTTC"), START)
+        self.archive.record("LOC000000000001", details("FTTP"), START + 10 * DAY)
+        self.archive.record("LOC000000000002", details("FTTC", "available"), START + 10 * DAY)
+        self.archive.record("LOC000000000002", details("FTTP", "available"), START + 40 * DAY)
+        self.archive.flush()
+
+        changes = self.archive.changes("techType", START, START + 30 * DAY)
+        self.assertEqual(changes, [{
+            "locID": "LOC000000000001",
+            "changedAt": "2026-01-11T00:00:00+00:00",
+            "from": "FTTN",
+            "to": "FTTP",
+        }])
+        everything = self.archive.changes("techType")
+        self.assertEqual([change["locID"] for change in everything],
+                         ["LOC000000000001", "LOC000000000002"])
+        self.assertEqual(everything[1]["from"], "FTTC")
+
+    def test_out_of_order_observations_are_ignored(self):
+        """Test older observations never rewrite newer history."""
+        self.archive.record("LOC000000000001", details("FTTP"), START + DAY)
+        self.archive.record("LOC000000000001", details("FTTN"), START)
+        self.archive.flush()
+
+        self.assertEqual(self._count("observations"), 1)
+
+    def test_unknown_loc(self):
+        """Test an unseen LOC ID has no history."""
+        self.assertIsNone(self.archive.history("LOC999"))
+
+
+class TestHistoryRoutes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {
+            "NBNCHECKER_HISTORY_DB": os.path.join(self.tmp.name, "history.sqlite3"),
+        })
+        self.env.start()
+        self.app = FastAPI()
+        self.app.include_router(history.router)
+
+    def tearDown(self):
+        history.close_archive()
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_routes(self):
+        """Test the history and change routes."""
+        history.record_details("LOC000000000001", details("FTTN"))
+        history.get_archive().flush()
+        with TestClient(self.app) as client:
+            loc = client.get("/api/history/loc000000000001")
+            missing = client.get("/api/history/LOC000000000009")
+            changes = client.get("/api/history/changes?since=2026-01-01&field=serviceStatus")
+            bad_field = client.get("/api/history/changes?field=nope")
+            bad_date = client.get("/api/history/changes?since=yesterday")
+
+        self.assertEqual(loc.json()["history"][0]["techType"], "FTTN")
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(changes.json(), [])
+        self.assertEqual(bad_field.status_code, 400)
+        self.assertEqual(bad_date.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import sys
+import os
+import tempfile
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'jobs'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import jobs
+from jobs import JobStore, JobWorker
+
+
+async def fake_lookup(address):
+    if address == "bad":
+        raise RuntimeError("upstream failed")
+    return {"selectedAddress": address.upper(), "locID": "LOC000000000001",
+            "details": {"exactMatch": True, "techType": "FTTP"}}
+
+
+class TestJobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "jobs.sqlite3")
+        self.store = JobStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_submit_splits_into_chunks(self):
+        """Test a job is split into chunk_size pieces."""
+        job_id = self.store.submit([f"{n} Test St" for n in range(5)], chunk_size=2)
+        status = self.store.status(job_id)
+        self.assertEqual(status["total"], 5)
+        self.assertEqual(status["chunks"]["total"], 3)
+        self.assertEqual(status["status"], "pending")
+
+    def test_claims_are_exclusive_across_connections(self):
+        """Test two processes sharing the file never claim the same chunk."""
+        other = JobStore(self.path)
+        try:
+            self.store.submit(["a", "b", "c"], chunk_size=1)
+            claims = [self.store.claim("one"), other.claim("two"), self.store.claim("one")]
+            self.assertIsNone(other.claim("two"))
+        finally:
+            other.close()
+        self.assertEqual(sorted(claim[1] for claim in claims), [0, 1, 2])
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test a chunk held by a dead worker is handed out again."""
+        store = JobStore(self.path, lease_seconds=-1)
+        try:
+            store.submit(["a"], chunk_size=1)
+            first = store.claim("dead")
+            second = store.claim("alive")
+        finally:
+            store.close()
+        self.assertEqual(first[:2], second[:2])
+
+    def test_complete_records_results_and_finishes(self):
+        """Test completing every chunk finishes the job and exposes results."""
+        job_id = self.store.submit(["a", "b"], chunk_size=1)
+        _, idx, rows = self.store.claim("w")
+        self.store.complete(job_id, idx, "w", [(rows[0][0], {"locID": "LOC1"}, None)])
+        partial = self.store.status(job_id)
+        _, idx, rows = self.store.claim("w")
+        self.store.complete(job_id, idx, "w", [(rows[0][0], None, "boom")])
+
+        self.assertEqual(partial["processed"], 1)
+        self.assertEqual(partial["status"], "running")
+        status = self.store.status(job_id)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["failed"], 1)
+        results = list(self.store.iter_results(job_id, page_size=1))
+        self.assertEqual(results[0]["result"], {"locID": "LOC1"})
+        self.assertEqual(results[1]["error"], "boom")
+
+    def test_stale_owner_cannot_complete(self):
+        """Test a worker whose lease was taken over can't overwrite results."""
+        store = JobStore(self.path, lease_seconds=-1)
+        try:
+            job_id = store.submit(["a"], chunk_size=1)
+            _, idx, rows = store.claim("slow")
+            store.claim("fast")
+            self.assertFalse(store.renew(job_id, idx, "slow"))
+            self.assertTrue(store.complete(job_id, idx, "fast", [(0, {"v": 2}, None)]))
+            self.assertFalse(store.complete(job_id, idx, "slow", [(0, {"v": 1}, None)]))
+            results = store.results(job_id)
+        finally:
+            store.close()
+        self.assertEqual(results[0]["result"], {"v": 2})
+
+    def test_chunk_abandoned_after_max_attempts(self):
+        """Test a chunk that keeps losing its lease eventually fails its rows."""
+        store = JobStore(self.path, lease_seconds=-1, max_attempts=2)
+        try:
+            job_id = store.submit(["a", "b"], chunk_size=2)
+            self.assertIsNotNone(store.claim("one"))
+            self.assertIsNotNone(store.claim("two"))
+            self.assertIsNone(store.claim("three"))
+            status = store.status(job_id)
+            results = store.results(job_id)
+        finally:
+            store.close()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["chunks"]["failed"], 1)
+        self.assertEqual(status["failed"], 2)
+        self.assertEqual(results[0]["error"], "Gave up after 2 attempts")
+
+    def test_release_does_not_count_as_attempt(self):
+        """Test a chunk handed back on shutdown keeps its attempt budget."""
+        store = JobStore(self.path, max_attempts=1)
+        try:
+            job_id = store.submit(["a"], chunk_size=1)
+            _, idx, _ = store.claim("one")
+            store.release(job_id, idx, "one")
+            self.assertIsNotNone(store.claim("two"))
+        finally:
+            store.close()
+
+
+class TestJobWorker(unittest.TestCase):
+    @patch("jobs.lookup", side_effect=fake_lookup)
+    def test_run_once_processes_chunk(self, _):
+        """Test a worker processes a chunk, keeping per-row errors."""
+        with tempfile.TemporaryDirectory() as tmp:
+            store = JobStore(os.path.join(tmp, "jobs.sqlite3"))
+            job_id = store.submit(["good", "bad"], chunk_size=10)
+            worker = JobWorker(store, "test")
+
+            self.assertTrue(asyncio.run(worker.run_once()))
+            self.assertFalse(asyncio.run(worker.run_once()))
+            results = store.results(job_id)
+            store.close()
+
+        self.assertEqual(results[0]["result"]["selectedAddress"], "GOOD")
+        self.assertEqual(results[1]["error"], "upstream failed")
+
+    def test_lease_renewed_during_slow_chunk(self):
+        """Test a chunk outliving its lease is kept by its worker, not reclaimed."""
+        async def slow_lookup(address):
+            await asyncio.sleep(0.5)
+            return {"selectedAddress": address}
+
+        async def run(store):
+            worker = JobWorker(store, "slow")
+            task = asyncio.create_task(worker.run_once())
+            await asyncio.sleep(0.3)
+            stolen = await asyncio.to_thread(store.claim, "thief")
+            return await task, stolen
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = JobStore(os.path.join(tmp, "jobs.sqlite3"), lease_seconds=0.2)
+            job_id = store.submit(["a"], chunk_size=1)
+            with patch("jobs.lookup", side_effect=slow_lookup):
+                processed, stolen = asyncio.run(run(store))
+            status = store.status(job_id)
+            store.close()
+
+        self.assertTrue(processed)
+        self.assertIsNone(stolen)
+        self.assertEqual(status["status"], "done")
+
+
+class TestJobRoutes(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = patch.dict(
+            os.environ,
+            {
+                "NBNCHECKER_JOBS_DB": os.path.join(self.tmp.name, "jobs.sqlite3"),
+                "NBNCHECKER_JOB_CHUNK_SIZE": "2",
+            },
+        )
+        self.env.start()
+        self.app = FastAPI()
+        self.app.include_router(jobs.router)
+
+    def tearDown(self):
+        if jobs._store is not None:
+            jobs._store.close()
+            jobs._store = None
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def test_disabled_without_database(self):
+        """Test the routes report 503 when no database is configured."""
+        with patch.dict(os.environ, {"NBNCHECKER_JOBS_DB": ""}):
+            with TestClient(self.app) as client:
+                response = client.get("/api/jobs/missing")
+        self.assertEqual(response.status_code, 503)
+
+    @patch("jobs.lookup", side_effect=fake_lookup)
+    def test_submit_process_and_download(self, _):
+        """Test a submitted job can be processed, tracked and downloaded."""
+        with TestClient(self.app) as client:
+            submitted = client.post(
+                "/api/jobs", content="1 Test St\n\n2 Test St\n3 Test St\n"
+            ).json()
+            job_id = submitted["id"]
+
+            worker = JobWorker(jobs.get_store(), "test")
+            asyncio.run(worker.run_once())
+            partial = client.get(f"/api/jobs/{job_id}/results").json()
+            asyncio.run(worker.run_once())
+
+            status = client.get(f"/api/jobs/{job_id}").json()
+            ndjson = client.get(f"/api/jobs/{job_id}/download")
+            csv = client.get(f"/api/jobs/{job_id}/download?format=csv")
+            missing = client.get("/api/jobs/nope")
+
+        self.assertEqual(submitted["total"], 3)
+        self.assertEqual(len(partial), 2)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(len(ndjson.text.splitlines()), 3)
+        self.assertIn("1 TEST ST", csv.text)
+        self.assertEqual(csv.text.splitlines()[0].split(",")[:2], ["row", "address"])
+        self.assertEqual(missing.status_code, 404)
+
+    def test_submit_json_validation(self):
+        """Test malformed JSON submissions are rejected."""
+        with TestClient(self.app) as client:
+            response = client.post("/api/jobs", json={"addresses": "1 Test St"})
+            not_json = client.post(
+                "/api/jobs",
+                content=b'{"addresses": [',
+                headers={"Content-Type": "application/json"},
+            )
+            not_utf8 = client.post(
+                "/api/jobs",
+                content=b"1 Test St\n\xff\xfe",
+                headers={"Content-Type": "text/plain"},
+            )
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(not_json.status_code, 422)
+        self.assertIn("addresses", not_json.json()["detail"])
+        self.assertEqual(not_utf8.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
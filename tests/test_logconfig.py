@@ -0,0 +1,98 @@
+import unittest
+import io
+import json
+import sys
+import os
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'logconfig'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from logconfig import (
+    RequestIdMiddleware,
+    configure_logging,
+    get_logger,
+    stop_logging,
+)
+
+
+class TestStructuredLogging(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.logger = get_logger("test")
+
+    def tearDown(self):
+        stop_logging()
+
+    def _lines(self):
+        stop_logging()  # Flushes the queue
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_json_with_extras(self):
+        """Test records are rendered as JSON including extra fields."""
+        configure_logging(stream=self.stream)
+        self.logger.info("Upstream %s call", "details", extra={"status": 200})
+
+        [line] = self._lines()
+        self.assertEqual(line["message"], "Upstream details call")
+        self.assertEqual(line["level"], "INFO")
+        self.assertEqual(line["logger"], "nbnchecker.test")
+        self.assertEqual(line["status"], 200)
+        self.assertIsNone(line["request_id"])
+
+    def test_exception_is_included(self):
+        """Test exception tracebacks survive the trip through the queue."""
+        configure_logging(stream=self.stream)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.exception("Lookup failed")
+
+        [line] = self._lines()
+        self.assertIn("ValueError: boom", line["exception"])
+
+    def test_level_control(self):
+        """Test records below the configured level are dropped."""
+        configure_logging(level="warning", stream=self.stream)
+        self.logger.info("quiet")
+        self.logger.warning("loud")
+
+        self.assertEqual([line["message"] for line in self._lines()], ["loud"])
+
+    def test_sampling_drops_only_sampled_info_lines(self):
+        """Test sampled lines are dropped at rate 0 while others are kept."""
+        configure_logging(sample_rate=0, stream=self.stream)
+        self.logger.info("noisy", extra={"sampled": True})
+        self.logger.info("important")
+        self.logger.warning("sampled warning", extra={"sampled": True})
+
+        messages = [line["message"] for line in self._lines()]
+        self.assertEqual(messages, ["important", "sampled warning"])
+
+    def test_request_id_middleware(self):
+        """Test request IDs are echoed in headers and stamped on log lines."""
+        configure_logging(stream=self.stream)
+        app = FastAPI()
+
+        @app.get("/")
+        async def index():
+            self.logger.info("handled")
+            return {}
+
+        app.add_middleware(RequestIdMiddleware)
+        with TestClient(app) as client:
+            supplied = client.get("/", headers={"X-Request-ID": "abc-123"})
+            generated = client.get("/")
+            rejected = client.get("/", headers={"X-Request-ID": "bad id\n"})
+
+        self.assertEqual(supplied.headers["X-Request-ID"], "abc-123")
+        self.assertEqual(len(generated.headers["X-Request-ID"]), 32)
+        self.assertNotEqual(rejected.headers["X-Request-ID"], "bad id\n")
+        ids = [line["request_id"] for line in self._lines()]
+        self.assertEqual(ids[0], "abc-123")
+        self.assertEqual(ids[1], generated.headers["X-Request-ID"])
+
+
+if __name__ == "__main__":
+    unittest.main()
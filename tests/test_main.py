@@ -5,13 +5,18 @@ from unittest.mock import (
     MagicMock,
     ANY,
     Mock,
+    AsyncMock,
 )  # ANY is useful for context matching
 import sys
 import os
 import json
+import time
 import importlib
 from fastapi.testclient import TestClient
 
+# Keep the app from opening upstream connections when TestClient starts it
+os.environ.setdefault("NBNCHECKER_UPSTREAM_PREWARM", "0")
+
 # Add the parent directory to the Python path to allow importing 'main'
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
@@ -49,6 +54,59 @@ class TestCheckAddressFunction(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("nbnco Address Service Check", response.text)
 
+    def test_readiness_separate_from_liveness(self):
+        """Test /health/ready only passes once startup has run."""
+        client = TestClient(app)
+        live = client.get("/health")
+        not_ready = client.get("/health/ready")
+        with TestClient(app) as started:
+            ready = started.get("/health/ready")
+
+        self.assertEqual(live.json(), {"status": "healthy"})
+        self.assertEqual(not_ready.status_code, 503)
+        self.assertEqual(ready.status_code, 200)
+        self.assertEqual(ready.json(), {"status": "ready"})
+
+    def test_upstream_stats_route(self):
+        """Test upstream connection stats are exported."""
+        with TestClient(app) as client:
+            response = client.get("/api/upstream/stats")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("reuse_ratio", response.json())
+
+    def test_client_usage_is_admin_only(self):
+        """Test per-client usage needs the admin token and lists clients."""
+        with patch.dict(os.environ, {"NBNCHECKER_ADMIN_TOKEN": "letmein"}):
+            client = TestClient(app)
+            client.get("/health")
+            hidden = client.get("/admin/clients")
+            shown = client.get(
+                "/admin/clients", headers={"X-Admin-Token": "letmein"}
+            )
+
+        self.assertEqual(hidden.status_code, 404)
+        self.assertEqual(shown.status_code, 200)
+        self.assertIn("ip:testclient", shown.json()["clients"])
+
+    def test_crawl_rejects_blank_seed(self):
+        """Test a blank crawl seed gets a 400 rather than a failed stream."""
+        response = TestClient(app).get("/api/crawl", params={"address": " "})
+        self.assertEqual(response.status_code, 400)
+
+    def test_crawls_have_their_own_admission(self):
+        """Test busy crawls are shed without touching the lookup slots."""
+        import main
+
+        main.crawl_admission.active = main.crawl_admission.limit
+        self.addCleanup(setattr, main.crawl_admission, "active", 0)
+        lookups_shed = main.admission.shed
+        response = TestClient(app).get("/api/crawl", params={"address": "1 Smith St"})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(main.admission.shed, lookups_shed)
+        self.assertEqual(main.admission.active, 0)
+
     def _patched_check_address(self):
         """Returns the original check_address function for patching."""
         from main import check_address
@@ -61,14 +119,14 @@ class TestCheckAddressFunction(unittest.TestCase):
 
     def _setup_mock_requests(self, responses=None):
         """
-        Sets up a custom mock for requests.get that works with async code.
+        Sets up a custom mock for upstream.get that works with async code.
         Args:
             responses: Dict mapping URL patterns to response objects
         Returns:
             Tuple of (mock_get, original_get)
         """
-        # Create a mock for requests.get
-        mock_get = MagicMock()
+        # Create a mock for upstream.get
+        mock_get = AsyncMock()
 
         # Function to find the correct response based on URL pattern
         def side_effect(url, headers=None, **kwargs):
@@ -87,13 +145,13 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set the side effect to use our custom function
         mock_get.side_effect = side_effect
 
-        # Save the original requests.get function
-        import requests
+        # Save the original upstream.get function
+        import upstream
 
-        original_get = requests.get
+        original_get = upstream.get
 
         # Replace the real function with our mock
-        requests.get = mock_get
+        upstream.get = mock_get
 
         return mock_get, original_get
 
@@ -133,7 +191,7 @@ class TestCheckAddressFunction(unittest.TestCase):
             "details": mock_details_response,
         }
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -151,9 +209,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_success_serving_area(self, mock_template_response):
@@ -183,7 +241,7 @@ class TestCheckAddressFunction(unittest.TestCase):
             "details": mock_details_response,
         }
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -200,9 +258,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_no_valid_suggestions(self, mock_template_response):
@@ -221,7 +279,7 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set up mock with expected responses
         responses = {"autocomplete": mock_addr_response}
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -238,9 +296,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_api_error(self, mock_template_response):
@@ -250,16 +308,16 @@ class TestCheckAddressFunction(unittest.TestCase):
         mock_request = MockRequest()
 
         # Create a mock that raises an exception
-        mock_get = MagicMock()
+        mock_get = AsyncMock()
         mock_get.side_effect = Exception("Network Error")
 
-        # Save the original requests.get function
-        import requests
+        # Save the original upstream.get function
+        import upstream
 
-        original_get = requests.get
+        original_get = upstream.get
 
         # Replace the real function with our mock
-        requests.get = mock_get
+        upstream.get = mock_get
 
         try:
             # --- Act ---
@@ -274,7 +332,7 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_direct_loc_id_success(self, mock_template_response):
@@ -301,7 +359,7 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set up mock with expected responses
         responses = {"details": mock_details_response}
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -318,9 +376,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_direct_loc_id_not_found(self, mock_template_response):
@@ -338,7 +396,7 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set up mock with expected responses
         responses = {"details": mock_details_response}
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -355,9 +413,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_direct_loc_id_serving_area(self, mock_template_response):
@@ -375,7 +433,7 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set up mock with expected responses
         responses = {"details": mock_details_response}
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -392,9 +450,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_multiple_suggestions_returned(self, mock_template_response):
@@ -419,7 +477,7 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set up mock with expected responses
         responses = {"autocomplete": mock_addr_response}
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -436,9 +494,9 @@ class TestCheckAddressFunction(unittest.TestCase):
             mock_template_response.assert_called_once()
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
 
     @patch("main.templates.TemplateResponse")
     def test_check_address_suggestion_selected(self, mock_template_response):
@@ -471,7 +529,7 @@ class TestCheckAddressFunction(unittest.TestCase):
         # Set up mock with expected responses
         responses = {"details": mock_details_response}
 
-        # Setup our mock by directly replacing requests.get
+        # Setup our mock by directly replacing upstream.get
         mock_get, original_get = self._setup_mock_requests(responses)
 
         try:
@@ -506,9 +564,143 @@ class TestCheckAddressFunction(unittest.TestCase):
             )
         finally:
             # Always restore the original function
-            import requests
+            import upstream
 
-            requests.get = original_get
+            upstream.get = original_get
+
+    @patch("main.templates.TemplateResponse")
+    def test_check_address_serving_area_cached(self, mock_template_response):
+        """Test a repeat lookup of a serving-area-only LOC ID skips the details API."""
+        # --- Arrange ---
+        test_loc_id = MockForm("LOC333444")
+        mock_request = MockRequest()
+
+        mock_details_response = MagicMock()
+        mock_details_response.json.return_value = {
+            "addressDetail": {},
+            "servingArea": {"csaId": "CSA555", "techType": "Fixed Wireless"},
+        }
+        mock_details_response.raise_for_status = MagicMock()
+
+        # Set up mock with expected responses
+        responses = {"details": mock_details_response}
+
+        # Setup our mock by directly replacing upstream.get
+        mock_get, original_get = self._setup_mock_requests(responses)
+
+        try:
+            # --- Act ---
+            async def test_coro():
+                return await check_address(
+                    request=mock_request, address=test_loc_id, loc_id_selected=None
+                )
+
+            with patch("main.record_details") as mock_record:
+                self._run_async(test_coro())
+                self._run_async(test_coro())
+
+            # --- Assert ---
+            self.assertEqual(mock_get.call_count, 1)
+            # Only the fetched response is archived, not the cached repeat
+            self.assertEqual(mock_record.call_count, 1)
+            second_context = mock_template_response.call_args_list[1][0][2]
+            self.assertEqual(
+                second_context["results"]["loc_details"],
+                {"exactMatch": False, "csaID": "CSA555", "techType": "Fixed Wireless"},
+            )
+        finally:
+            # Always restore the original function
+            import upstream
+
+            upstream.get = original_get
+
+
+class TestCompare(unittest.TestCase):
+    def setUp(self):
+        import servingarea
+
+        # Keep serving-area entries cached by other tests out of the way
+        patcher = patch("servingarea.serving_areas", servingarea.ServingAreaCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fake_get(self, delay):
+        """Returns an upstream.get stand-in that answers after `delay` seconds."""
+        async def get(url, **kwargs):
+            await asyncio.sleep(delay)
+            response = MagicMock()
+            if "autocomplete" in url:
+                query = kwargs["params"]["query"]
+                suggestions = [] if query == "Nowhere" else [
+                    {"id": "LOC000000000009", "formattedAddress": query.upper()}
+                ]
+                response.json.return_value = {"suggestions": suggestions}
+            else:
+                loc_id = url.rsplit("/", 1)[-1]
+                response.json.return_value = {"addressDetail": {
+                    "id": loc_id, "techType": "FTTP", "serviceStatus": "available",
+                    "coatChangeReason": "", "formattedAddress": f"Home of {loc_id}",
+                }}
+            return response
+
+        return get
+
+    @patch("main.record_details")
+    def test_compare_fetches_concurrently(self, _):
+        """Test a comparison takes about as long as one lookup, not the sum."""
+        form = {"addresses": "LOC000000000001\nLOC000000000002\n1 Test St\nLOC000000000001"}
+        with patch("upstream.get", side_effect=self._fake_get(0.3)) as mock_get:
+            client = TestClient(app)
+            started = time.perf_counter()
+            response = client.post("/compare", data=form)
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(response.status_code, 200)
+        # Four calls (the repeated LOC ID is looked up once), two rounds deep
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertLess(elapsed, 0.3 * 4)
+        self.assertIn("Home of LOC000000000002", response.text)
+        self.assertIn("1 TEST ST", response.text)
+        self.assertEqual(response.text.count("<tr>"), 4)
+
+    def test_compare_reports_per_row_errors_and_limits(self):
+        """Test unmatched addresses show inline and oversized lists are refused."""
+        with patch("upstream.get", side_effect=self._fake_get(0)):
+            client = TestClient(app)
+            response = client.post("/compare", data={"addresses": "Nowhere"})
+            too_many = client.post(
+                "/compare",
+                data={"addresses": "\n".join(f"LOC{n:012d}" for n in range(11))},
+            )
+
+        self.assertIn("No valid matches for this address", response.text)
+        self.assertIn("Up to 10 addresses", too_many.text)
+
+    def test_compare_uses_response_cache(self):
+        """Test a repeated comparison is answered from the response cache."""
+        import cache
+
+        self.addCleanup(setattr, cache, "_cache", None)
+        form = {"addresses": "LOC000000000001\n1 Test St"}
+        with patch.dict(os.environ, {"NBNCHECKER_CACHE_URL": "memory"}), patch(
+            "upstream.get", side_effect=self._fake_get(0)
+        ) as mock_get, patch("main.record_details") as mock_record:
+            client = TestClient(app)
+            first = client.post("/compare", data=form)
+            second = client.post("/compare", data=form)
+            stats = client.get("/api/cache/stats").json()
+
+        self.assertEqual(first.text, second.text)
+        self.assertEqual(mock_get.call_count, 3)
+        # Cached details came from an earlier fetch that was already archived
+        self.assertEqual(mock_record.call_count, 2)
+        self.assertEqual(stats["hits"], 3)
+
+    def test_compare_form(self):
+        """Test the empty comparison form renders."""
+        response = TestClient(app).get("/compare")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('name="addresses"', response.text)
 
 
 if __name__ == "__main__":
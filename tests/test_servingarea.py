@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+from fastapi.testclient import TestClient
+
+# Add the parent directory to the Python path to allow importing 'servingarea'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import servingarea
+from servingarea import ServingAreaCache
+
+
+def serving_area_only(csa_id="CSA100", tech="FTTN"):
+    return {"addressDetail": {}, "servingArea": {"csaId": csa_id, "techType": tech,
+                                                 "serviceStatus": "available"}}
+
+
+def exact(loc_id, csa_id="CSA100", tech="FTTP", status="available"):
+    return {"addressDetail": {"id": loc_id, "techType": tech, "serviceStatus": status},
+            "servingArea": {"csaId": csa_id, "techType": "FTTN",
+                            "serviceStatus": "available"}}
+
+
+class TestServingAreaCache(unittest.TestCase):
+    def test_non_exact_premises_served_from_csa(self):
+        """Test a LOC ID resolving only to a CSA is answered from the cache."""
+        cache = ServingAreaCache()
+        self.assertIsNone(cache.lookup("LOC1"))
+        cache.observe("LOC1", serving_area_only())
+
+        cached = cache.lookup("LOC1")
+        self.assertEqual(cached["servingArea"]["csaId"], "CSA100")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_exact_premises_are_not_served_from_csa(self):
+        """Test exact matches always refetch their premises-level details."""
+        cache = ServingAreaCache()
+        cache.observe("LOC2", exact("LOC2"))
+        self.assertIsNone(cache.lookup("LOC2"))
+
+    def test_expired_area_is_refetched(self):
+        """Test CSA entries stop serving lookups once they expire."""
+        cache = ServingAreaCache(ttl=-1)
+        cache.observe("LOC1", serving_area_only())
+        self.assertIsNone(cache.lookup("LOC1"))
+
+    def test_aggregate_counts(self):
+        """Test per-CSA counts span exact and non-exact premises."""
+        cache = ServingAreaCache()
+        cache.observe("LOC1", serving_area_only())
+        cache.observe("LOC2", exact("LOC2"))
+        cache.observe("LOC3", exact("LOC3", status="planned"))
+        cache.observe("LOC4", exact("LOC4", csa_id="CSA200"))
+
+        aggregate = cache.aggregate("CSA100")
+        self.assertEqual(aggregate["premises"], 3)
+        self.assertEqual(aggregate["exactMatches"], 2)
+        self.assertEqual(aggregate["techType"], {"FTTN": 1, "FTTP": 2})
+        self.assertEqual(aggregate["serviceStatus"], {"available": 2, "planned": 1})
+        self.assertEqual(cache.summary()[0], {"csaId": "CSA100", "premises": 3})
+
+    def test_eviction_drops_empty_areas(self):
+        """Test the premises limit evicts the oldest links and their empty CSAs."""
+        cache = ServingAreaCache(max_premises=1)
+        cache.observe("LOC1", serving_area_only("CSA100"))
+        cache.observe("LOC2", serving_area_only("CSA200"))
+
+        self.assertIsNone(cache.aggregate("CSA100"))
+        self.assertEqual(cache.stats()["areas"], 1)
+
+
+class TestServingAreaRoutes(unittest.TestCase):
+    def test_routes(self):
+        """Test the CSA listing and detail routes."""
+        cache = ServingAreaCache()
+        cache.observe("LOC1", serving_area_only())
+        from main import app
+
+        with patch("servingarea.serving_areas", cache):
+            with TestClient(app) as client:
+                listing = client.get("/api/csa").json()
+                detail = client.get("/api/csa/csa100")
+                missing = client.get("/api/csa/CSA999")
+
+        self.assertEqual(listing["areas"], [{"csaId": "CSA100", "premises": 1}])
+        self.assertEqual(detail.json()["techType"], {"FTTN": 1})
+        self.assertEqual(missing.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
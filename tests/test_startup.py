@@ -0,0 +1,71 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Generous enough for a loaded CI runner; a regression past this is a real one
+STARTUP_BUDGET = float(os.environ.get("NBNCHECKER_STARTUP_BUDGET", "5"))
+
+
+def run_python(code, **env):
+    """Runs code in a fresh interpreter, as a new container would."""
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=APP_DIR,
+        env={**os.environ, "NBNCHECKER_UPSTREAM_PREWARM": "0", **env},
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+class TestColdStart(unittest.TestCase):
+    def test_rarely_used_modules_are_deferred(self):
+        """Test importing the app doesn't load the server or the crawler."""
+        loaded = run_python(
+            "import json, sys, main; "
+            "print(json.dumps([m for m in ('uvicorn', 'crawler', 'cProfile', "
+            "'tracemalloc') if m in sys.modules]))"
+        )
+        self.assertEqual(loaded, [])
+
+    def test_library_import_is_framework_free(self):
+        """Test api.py can be used without importing the web framework."""
+        loaded = run_python(
+            "import json, sys, api; "
+            "print(json.dumps([m for m in ('fastapi', 'starlette', 'jinja2') "
+            "if m in sys.modules]))"
+        )
+        self.assertEqual(loaded, [])
+
+    def test_startup_to_ready_within_budget(self):
+        """Test import plus startup to a ready /health/ready stays within budget."""
+        with tempfile.TemporaryDirectory() as cache:
+            run_python("import precompile; precompile.precompile(); print(1)",
+                       NBNCHECKER_TEMPLATE_CACHE=cache)
+            self.assertTrue(os.listdir(cache))
+            timings = run_python(
+                "import json, time\n"
+                "started = time.perf_counter()\n"
+                "from fastapi.testclient import TestClient\n"
+                "import main\n"
+                "imported = time.perf_counter()\n"
+                "with TestClient(main.app) as client:\n"
+                "    assert client.get('/health/ready').status_code == 200\n"
+                "    ready = time.perf_counter()\n"
+                "print(json.dumps({'import': imported - started, "
+                "'ready': ready - started}))",
+                NBNCHECKER_TEMPLATE_CACHE=cache,
+            )
+        self.assertLess(timings["ready"], STARTUP_BUDGET, timings)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import sys
+import os
+import threading
+import time
+import httpx
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to the Python path to allow importing 'upstream'
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import upstream
+from upstream import DNSCache, Stats
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUpstreamPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        cls.url = f"http://localhost:{cls.server.server_address[1]}/"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.stats = Stats()
+        patches = [
+            patch("upstream.stats", self.stats),
+            patch("upstream.dns_cache", DNSCache(ttl=60)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_async_requests_reuse_one_connection(self):
+        """Test sequential async requests share a pooled connection and DNS entry."""
+        async def run():
+            try:
+                for _ in range(3):
+                    response = await upstream.get(self.url)
+                    self.assertEqual(response.json(), {"ok": True})
+            finally:
+                await upstream.close()
+
+        asyncio.run(run())
+        snapshot = self.stats.snapshot()
+        self.assertEqual(snapshot["requests"], 3)
+        self.assertEqual(snapshot["connections_opened"], 1)
+        self.assertEqual(snapshot["requests_on_reused_connections"], 2)
+        self.assertEqual(snapshot["dns_cache"], {"hits": 0, "misses": 1})
+
+    def test_sync_requests_reuse_one_connection(self):
+        """Test the blocking client pools connections the same way."""
+        try:
+            for _ in range(2):
+                upstream.get_sync(self.url).raise_for_status()
+        finally:
+            asyncio.run(upstream.close())
+
+        self.assertEqual(self.stats.snapshot()["connections_opened"], 1)
+
+    def test_prewarm_opens_connection_before_first_request(self):
+        """Test a pre-warmed pool serves the first real request without connecting."""
+        async def run():
+            try:
+                with patch("upstream.NBN_BASE_URL", self.url):
+                    await upstream.prewarm(connections=1)
+                opened = self.stats.connections
+                await upstream.get(self.url)
+                return opened
+            finally:
+                await upstream.close()
+
+        self.assertEqual(asyncio.run(run()), 1)
+        self.assertEqual(self.stats.connections, 1)
+        self.assertEqual(self.stats.prewarms, 1)
+
+
+    def test_client_closed_with_its_loop(self):
+        """Test the shared client is closed when asyncio.run() ends its loop."""
+        async def run():
+            client = upstream.async_client()
+            await client.get(self.url)
+            return client
+
+        first = asyncio.run(run())
+        self.assertTrue(first.is_closed)
+        second = asyncio.run(run())
+        self.assertIsNot(first, second)
+        self.assertTrue(second.is_closed)
+
+    def test_keep_warm_sleeps_until_idle_deadline(self):
+        """Test recent requests push the next re-warm back rather than skip it."""
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+            raise asyncio.CancelledError
+
+        async def run():
+            with patch("upstream.prewarm") as prewarm, patch("asyncio.sleep", sleep):
+                upstream._last_used = time.monotonic() - 20
+                with self.assertRaises(asyncio.CancelledError):
+                    await upstream.keep_warm(interval=50)
+                return prewarm.call_count
+
+        self.assertEqual(asyncio.run(run()), 0)
+        self.assertAlmostEqual(sleeps[0], 30, delta=1)
+
+    def test_client_calls_hold_a_scheduler_slot(self):
+        """Test calls made for a client take turns and free their slot when done."""
+        import fairqueue
+
+        scheduler = fairqueue.FairScheduler(limit=1)
+        client = fairqueue.Client("someone")
+
+        async def run():
+            token = fairqueue.client_var.set(client)
+            try:
+                responses = await asyncio.gather(
+                    *(upstream.get(self.url) for _ in range(3))
+                )
+            finally:
+                fairqueue.client_var.reset(token)
+                await upstream.close()
+            return [r.json() for r in responses]
+
+        with patch("fairqueue.get_scheduler", return_value=scheduler):
+            self.assertEqual(asyncio.run(run()), [{"ok": True}] * 3)
+        usage = scheduler.stats()["clients"]["someone"]
+        self.assertEqual((usage["calls"], usage["in_flight"]), (3, 0))
+        self.assertEqual(scheduler.active, 0)
+
+    def test_connection_errors_are_httpx_errors(self):
+        """Test httpcore failures surface as the matching httpx exceptions."""
+        port = self.server.server_address[1]
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            with self.assertRaises(httpx.ConnectError):
+                upstream.get_sync(f"http://127.0.0.1:{port}/")
+        finally:
+            asyncio.run(upstream.close())
+            self.setUpClass()
+
+
+class TestDNSCache(unittest.TestCase):
+    def test_entries_expire(self):
+        """Test cached addresses are only served within their TTL."""
+        with patch("upstream.stats", Stats()):
+            cache = DNSCache(ttl=-1)
+            cache.put("example.com", 443, [(None, None, None, None, ("192.0.2.1", 443))])
+            self.assertIsNone(cache.get("example.com", 443))
+
+            cache = DNSCache(ttl=60)
+            cache.put("example.com", 443, [(None, None, None, None, ("192.0.2.1", 443))])
+            self.assertEqual(cache.get("example.com", 443), "192.0.2.1")
+            cache.forget("example.com", 443)
+            self.assertIsNone(cache.get("example.com", 443))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator
+from typing import Optional
+
+import httpcore
+import httpx
+
+import fairqueue
+
+# Kept free of web framework imports so api.py stays usable as a library;
+# this is the logger logconfig.get_logger("upstream") would return
+logger = logging.getLogger("nbnchecker.upstream")
+
+NBN_BASE_URL = "https://places.nbnco.net.au"
+NBN_HEADERS = {"Referer": "https://www.nbnco.com.au"}
+
+HTTP2 = os.environ.get("NBNCHECKER_UPSTREAM_HTTP2", "1") == "1"
+MAX_CONNECTIONS = int(os.environ.get("NBNCHECKER_UPSTREAM_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.environ.get("NBNCHECKER_UPSTREAM_KEEPALIVE", "60"))
+DNS_TTL = float(os.environ.get("NBNCHECKER_UPSTREAM_DNS_TTL", "300"))
+TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+
+class Stats:
+    """Counters describing how well upstream connections are being reused."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.prewarms = 0
+        self.http_versions: dict[str, int] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def response(self, http_version: str) -> None:
+        with self._lock:
+            self.requests += 1
+            self.http_versions[http_version] = (
+                self.http_versions.get(http_version, 0) + 1
+            )
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reused = max(self.requests - self.connections, 0)
+            return {
+                "http2_enabled": HTTP2,
+                "requests": self.requests,
+                "connections_opened": self.connections,
+                "requests_on_reused_connections": reused,
+                "reuse_ratio": (
+                    round(reused / self.requests, 3) if self.requests else None
+                ),
+                "dns_cache": {"hits": self.dns_hits, "misses": self.dns_misses},
+                "prewarms": self.prewarms,
+                "http_versions": dict(self.http_versions),
+            }
+
+
+stats = Stats()
+
+
+class DNSCache:
+    """Caches resolved addresses for a fixed TTL."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, int], tuple[float, str]] = {}
+
+    def get(self, host: str, port: int) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is None or entry[0] < time.monotonic():
+            stats.incr("dns_misses")
+            return None
+        stats.incr("dns_hits")
+        return entry[1]
+
+    def put(self, host: str, port: int, infos: list) -> str:
+        address = infos[0][4][0]
+        with self._lock:
+            self._entries[(host, port)] = (time.monotonic() + self.ttl, address)
+        return address
+
+    def forget(self, host: str, port: int) -> None:
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+dns_cache = DNSCache(DNS_TTL)
+
+
+class AsyncCachingBackend(httpcore.AsyncNetworkBackend):
+    """Resolves through the DNS cache and counts new connections.
+
+    httpcore still uses the original host name for SNI and certificate
+    checks, so connecting to the cached IP is transparent to TLS.
+    """
+
+    def __init__(self):
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self, host, port, timeout=None, local_address=None, socket_options=None
+    ):
+        address = dns_cache.get(host, port)
+        if address is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM
+            )
+            address = dns_cache.put(host, port, infos)
+        try:
+            stream = await self._backend.connect_tcp(
+                address,
+                port,
+                timeout=timeout,
+                local_address=local_address,
+                socket_options=socket_options,
+            )
+        except Exception:
+            # The cached address may be stale; resolve afresh next time
+            dns_cache.forget(host, port)
+            raise
+        stats.incr("connections")
+        return stream
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options
+        )
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class SyncCachingBackend(httpcore.NetworkBackend):
+    """Blocking counterpart of AsyncCachingBackend for the sync client."""
+
+    def __init__(self):
+        self._backend = httpcore.SyncBackend()
+
+    def connect_tcp(
+        self, host, port, timeout=None, local_address=None, socket_options=None
+    ):
+        address = dns_cache.get(host, port)
+        if address is None:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            address = dns_cache.put(host, port, infos)
+        try:
+            stream = self._backend.connect_tcp(
+                address,
+                port,
+                timeout=timeout,
+                local_address=local_address,
+                socket_options=socket_options,
+            )
+        except Exception:
+            dns_cache.forget(host, port)
+            raise
+        stats.incr("connections")
+        return stream
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return self._backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options
+        )
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+# httpx mirrors httpcore's exception names, so these map across one-to-one
+_HTTPCORE_ERRORS = (
+    httpcore.TimeoutException,
+    httpcore.NetworkError,
+    httpcore.ProtocolError,
+    httpcore.ProxyError,
+    httpcore.UnsupportedProtocol,
+)
+
+
+def _httpx_error(exc: Exception, request: httpx.Request) -> httpx.TransportError:
+    error = getattr(httpx, type(exc).__name__, httpx.TransportError)
+    return error(str(exc), request=request)
+
+
+def _httpcore_request(request: httpx.Request) -> httpcore.Request:
+    return httpcore.Request(
+        method=request.method,
+        url=httpcore.URL(
+            scheme=request.url.raw_scheme,
+            host=request.url.raw_host,
+            port=request.url.port,
+            target=request.url.raw_path,
+        ),
+        headers=request.headers.raw,
+        content=request.stream,
+        extensions=request.extensions,
+    )
+
+
+def _pool_options(max_connections: int) -> dict:
+    return {
+        "ssl_context": httpx.create_ssl_context(),
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_connections,
+        "keepalive_expiry": KEEPALIVE_EXPIRY,
+        "http2": HTTP2,
+        "retries": 1,
+    }
+
+
+class _AsyncResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream, request: httpx.Request, on_close=None):
+        self._stream = stream
+        self._request = request
+        self._on_close = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except _HTTPCORE_ERRORS as e:
+            raise _httpx_error(e, self._request) from e
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                on_close, self._on_close = self._on_close, None
+                on_close()
+
+
+class _ResponseStream(httpx.SyncByteStream):
+    def __init__(self, stream, request: httpx.Request):
+        self._stream = stream
+        self._request = request
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield from self._stream
+        except _HTTPCORE_ERRORS as e:
+            raise _httpx_error(e, self._request) from e
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class AsyncPoolTransport(httpx.AsyncBaseTransport):
+    """An httpx transport over an httpcore pool using AsyncCachingBackend.
+
+    Requests made on behalf of a client (see fairqueue.client_var) wait for
+    their turn from the fair scheduler and hold a slot until the response
+    is closed.
+    """
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS):
+        self._pool = httpcore.AsyncConnectionPool(
+            network_backend=AsyncCachingBackend(), **_pool_options(max_connections)
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        client = fairqueue.client_var.get()
+        scheduler = fairqueue.get_scheduler() if client is not None else None
+        release = None
+        if scheduler is not None:
+            await scheduler.acquire(client)
+
+            def release():
+                scheduler.release(client)
+
+        try:
+            response = await self._pool.handle_async_request(
+                _httpcore_request(request)
+            )
+        except BaseException as e:
+            if release is not None:
+                release()
+            if isinstance(e, _HTTPCORE_ERRORS):
+                raise _httpx_error(e, request) from e
+            raise
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_AsyncResponseStream(response.stream, request, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+
+class PoolTransport(httpx.BaseTransport):
+    """Blocking counterpart of AsyncPoolTransport using SyncCachingBackend."""
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS):
+        self._pool = httpcore.ConnectionPool(
+            network_backend=SyncCachingBackend(), **_pool_options(max_connections)
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            response = self._pool.handle_request(_httpcore_request(request))
+        except _HTTPCORE_ERRORS as e:
+            raise _httpx_error(e, request) from e
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_ResponseStream(response.stream, request),
+            extensions=response.extensions,
+        )
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+async def _count_response(response: httpx.Response) -> None:
+    stats.response(response.http_version)
+
+
+def _count_response_sync(response: httpx.Response) -> None:
+    stats.response(response.http_version)
+
+
+def create_async_client(max_connections: int = MAX_CONNECTIONS) -> httpx.AsyncClient:
+    """Creates a new async NBN API client; the caller is responsible for closing it."""
+    return httpx.AsyncClient(
+        transport=AsyncPoolTransport(max_connections),
+        headers=NBN_HEADERS,
+        timeout=TIMEOUT,
+        event_hooks={"response": [_count_response]},
+    )
+
+
+async def _close_with_loop(client: httpx.AsyncClient):
+    # asyncio.run() finalises pending async generators before it closes the
+    # loop, which lets the pool close its sockets on the loop that owns them
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+_async_client: Optional[httpx.AsyncClient] = None
+_async_closer = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+_last_used = 0.0
+
+
+def async_client() -> httpx.AsyncClient:
+    """Returns the shared async client, creating it on first use.
+
+    Pooled connections belong to the event loop that opened them, so a new
+    client is created if this is called from a different loop. The client is
+    closed when its loop shuts down through asyncio.run() or an
+    equivalent runner.
+    """
+    global _async_client, _async_closer, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client.is_closed or _async_loop is not loop:
+        if (
+            _async_client is not None
+            and not _async_client.is_closed
+            and not _async_loop.is_closed()
+        ):
+            # Still open on a loop that hasn't shut down yet
+            asyncio.run_coroutine_threadsafe(_async_closer.aclose(), _async_loop)
+        _async_loop = loop
+        _async_client = create_async_client()
+        _async_closer = _close_with_loop(_async_client)
+        # Run to the yield so the loop tracks (and later finalises) it
+        try:
+            _async_closer.__anext__().send(None)
+        except StopIteration:
+            pass
+    return _async_client
+
+
+def sync_client() -> httpx.Client:
+    """Returns the shared blocking client, creating it on first use."""
+    global _sync_client
+    with _client_lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(
+                transport=PoolTransport(),
+                headers=NBN_HEADERS,
+                timeout=TIMEOUT,
+                event_hooks={"response": [_count_response_sync]},
+            )
+        return _sync_client
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    """GETs an upstream URL over the shared async connection pool."""
+    global _last_used
+    _last_used = time.monotonic()
+    return await async_client().get(url, **kwargs)
+
+
+def get_sync(url: str, **kwargs) -> httpx.Response:
+    """GETs an upstream URL over the shared blocking connection pool."""
+    global _last_used
+    _last_used = time.monotonic()
+    return sync_client().get(url, **kwargs)
+
+
+async def prewarm(connections: Optional[int] = None) -> None:
+    """Opens connections to the NBN API ahead of the first real request.
+
+    One connection is enough for HTTP/2; HTTP/1.1 needs one per concurrent
+    request, so a few are opened in parallel.
+    """
+    global _last_used
+    if connections is None:
+        connections = 1 if HTTP2 else int(
+            os.environ.get("NBNCHECKER_UPSTREAM_PREWARM", "2")
+        )
+    client = async_client()
+
+    async def touch():
+        try:
+            await client.head(NBN_BASE_URL)
+        except httpx.HTTPError as e:
+            logger.warning(
+                "Upstream pre-warm failed",
+                extra={"event": "upstream_prewarm", "error": str(e)},
+            )
+
+    await asyncio.gather(*(touch() for _ in range(max(connections, 1))))
+    _last_used = time.monotonic()
+    stats.incr("prewarms")
+
+
+async def keep_warm(interval: Optional[float] = None) -> None:
+    """Warms the pool now, then again whenever it sits idle close to expiry."""
+    interval = interval or KEEPALIVE_EXPIRY * 0.9
+    while True:
+        # Any request in the meantime moves the deadline back
+        idle_for = time.monotonic() - _last_used
+        if idle_for >= interval:
+            await prewarm()
+            idle_for = 0
+        await asyncio.sleep(interval - idle_for)
+
+
+async def close() -> None:
+    """Closes both shared clients."""
+    global _async_client, _async_closer, _sync_client
+    if _async_closer is not None:
+        await _async_closer.aclose()
+        _async_client = _async_closer = None
+    with _client_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+